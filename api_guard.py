@@ -0,0 +1,542 @@
+import hashlib
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# =========================================================
+# 解析接口调用保护：限流 / 多 Key 轮换 / 重试与熔断
+# =========================================================
+# 每个 (引擎, API Key) 共用一个 EngineLimiter，进程内所有线程 / 会话共享：
+#   - 令牌桶限制每秒请求数，所有 API 调用（预上传、状态轮询、导出、结果查询）都先取令牌；
+#   - 同时进行中的解析任务数有上限，超出的任务在本地排队，而不是挤到服务商那里被 429；
+#   - 收到 429 时按 Retry-After 暂停整个桶，同一 Key 的其他线程一起让路。
+# 预签名的上传 / 下载链接走对象存储，不计入接口限流。
+
+# 默认限额，可用环境变量覆盖，也可在侧边栏运行时调整
+ENGINE_LIMITS = {
+    "doc2x": {
+        "rate": float(os.environ.get("DOC2X_RPS", 5)),
+        "max_inflight": int(os.environ.get("DOC2X_MAX_INFLIGHT", 8)),
+    },
+    "mineru": {
+        "rate": float(os.environ.get("MINERU_RPS", 5)),
+        "max_inflight": int(os.environ.get("MINERU_MAX_INFLIGHT", 8)),
+    },
+}
+
+# 429 未给出 Retry-After 时的暂停秒数
+DEFAULT_THROTTLE_SECONDS = 5.0
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self._lock = threading.Lock()
+        self._blocked_until = 0.0
+        self.configure(rate, capacity)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+
+    def configure(self, rate, capacity=None):
+        with self._lock:
+            self.rate = max(0.01, float(rate))
+            self.capacity = float(capacity or max(1.0, self.rate))
+
+    def acquire(self):
+        """取一个令牌，没有就阻塞等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if now >= self._blocked_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = max(self._blocked_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """在 seconds 秒内不再发放令牌（服务端限流时使用）"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+    def paused_for(self):
+        with self._lock:
+            return max(0.0, self._blocked_until - time.monotonic())
+
+
+class EngineLimiter:
+    def __init__(self, rate, max_inflight):
+        self.bucket = TokenBucket(rate)
+        self.max_inflight = max(1, int(max_inflight))
+        self._inflight = 0
+        self._cond = threading.Condition()
+
+    def configure(self, rate=None, max_inflight=None):
+        if rate is not None:
+            self.bucket.configure(rate)
+        if max_inflight is not None:
+            with self._cond:
+                self.max_inflight = max(1, int(max_inflight))
+                self._cond.notify_all()
+
+    def acquire(self):
+        """每次 API 调用前调用"""
+        self.bucket.acquire()
+
+    def throttle(self, response):
+        """服务端返回 429 时调用，按 Retry-After 暂停该 Key 的所有请求"""
+        try:
+            seconds = float(response.headers.get("Retry-After", DEFAULT_THROTTLE_SECONDS))
+        except (TypeError, ValueError):
+            seconds = DEFAULT_THROTTLE_SECONDS
+        self.bucket.pause(seconds)
+
+    def throttled_for(self):
+        """距离限流解除还有多少秒"""
+        return self.bucket.paused_for()
+
+    @contextmanager
+    def parse_slot(self):
+        """占用一个“进行中的解析”名额，从提交到拿到结果期间持有"""
+        with self._cond:
+            while self._inflight >= self.max_inflight:
+                self._cond.wait()
+            self._inflight += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._inflight -= 1
+                self._cond.notify()
+
+    @property
+    def inflight(self):
+        return self._inflight
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(engine, api_key):
+    """取得 (引擎, API Key) 对应的共享限流器"""
+    with _limiters_lock:
+        key = (engine, api_key)
+        if key not in _limiters:
+            limits = ENGINE_LIMITS[engine]
+            _limiters[key] = EngineLimiter(limits["rate"], limits["max_inflight"])
+        return _limiters[key]
+
+
+def configure_engine_limits(engine, rate=None, max_inflight=None):
+    """调整某个引擎的限额，已创建的限流器立即生效"""
+    with _limiters_lock:
+        if rate is not None: ENGINE_LIMITS[engine]["rate"] = float(rate)
+        if max_inflight is not None: ENGINE_LIMITS[engine]["max_inflight"] = int(max_inflight)
+        for (name, _), limiter in _limiters.items():
+            if name == engine:
+                limiter.configure(rate, max_inflight)
+
+
+# =========================================================
+# 多 API Key 轮换
+# =========================================================
+# 侧边栏每个引擎可以填多个 Key（逗号或换行分隔）。每个任务提交前按
+# “当前负载 → 今日剩余额度” 选 Key；被限流的 Key 暂时让位，额度用完的 Key 当天不再使用。
+# Key 的用量状态按 (引擎, Key) 记录在进程内，所有会话共享。
+
+# 每个 Key 每日可解析页数，未设置则不限
+DAILY_PAGE_QUOTA = {
+    "doc2x": int(os.environ["DOC2X_DAILY_PAGES"]) if os.environ.get("DOC2X_DAILY_PAGES") else None,
+    "mineru": int(os.environ["MINERU_DAILY_PAGES"]) if os.environ.get("MINERU_DAILY_PAGES") else None,
+}
+
+# 服务商返回这些内容时视为额度耗尽
+QUOTA_ERROR_MARKERS = ("quota", "额度", "余额", "insufficient")
+
+
+class QuotaExceededError(Exception):
+    pass
+
+
+def is_quota_error(response):
+    if response.status_code == 200: return False
+    if response.status_code == 402: return True
+    text = (response.text or "").lower()
+    return any(marker in text for marker in QUOTA_ERROR_MARKERS)
+
+
+def parse_api_keys(value):
+    """侧边栏输入 -> Key 列表；已经是列表时原样去重返回"""
+    if not value: return []
+    items = value if isinstance(value, (list, tuple)) else value.replace("\n", ",").split(",")
+    keys = []
+    for item in items:
+        item = item.strip()
+        if item and item not in keys: keys.append(item)
+    return keys
+
+
+def key_fingerprint(api_key):
+    """写入任务日志的 Key 标识（不保存 Key 本身）"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+class _KeyState:
+    def __init__(self):
+        self.day = None
+        self.used_pages = 0.0
+        self.active = 0
+        self.exhausted_day = None
+
+
+_key_states = {}
+_key_states_lock = threading.Lock()
+
+
+class KeyPool:
+    def __init__(self, engine, api_keys):
+        self.engine = engine
+        self.keys = parse_api_keys(api_keys)
+
+    def _state(self, api_key):
+        # 调用方需持有 _key_states_lock
+        state = _key_states.setdefault((self.engine, api_key), _KeyState())
+        today = date.today()
+        if state.day != today:
+            state.day = today
+            state.used_pages = 0.0
+        return state
+
+    def _remaining(self, state):
+        quota = DAILY_PAGE_QUOTA.get(self.engine)
+        return float("inf") if quota is None else quota - state.used_pages
+
+    def _choose(self, cost, prefer=None):
+        # 调用方需持有 _key_states_lock
+        if prefer:
+            for api_key in self.keys:
+                if key_fingerprint(api_key) == prefer: return api_key
+            raise Exception("任务提交时使用的 API Key 已不在当前配置中，无法续跑")
+        today = date.today()
+        candidates = []
+        for api_key in self.keys:
+            state = self._state(api_key)
+            if state.exhausted_day == today: continue
+            remaining = self._remaining(state)
+            limiter = get_limiter(self.engine, api_key)
+            candidates.append((
+                remaining < (cost or 0),              # 额度不够本任务的排在后面
+                limiter.throttled_for() > 0,          # 正被限流的排在后面
+                state.active / limiter.max_inflight,  # 负载低的优先
+                -remaining,                           # 剩余额度多的优先
+                api_key,
+            ))
+        if not candidates:
+            raise QuotaExceededError("所有 API Key 今日额度已用完")
+        return min(candidates)[-1]
+
+    @contextmanager
+    def lease(self, cost=None, prefer=None):
+        """选出一个 Key 并在任务期间计入其负载；prefer 为续跑任务原 Key 的指纹"""
+        if not self.keys: raise Exception("未配置 API Key")
+        with _key_states_lock:
+            api_key = self._choose(cost, prefer)
+            self._state(api_key).active += 1
+        try:
+            yield api_key
+        finally:
+            with _key_states_lock:
+                self._state(api_key).active -= 1
+
+    def record_usage(self, api_key, pages):
+        with _key_states_lock:
+            self._state(api_key).used_pages += pages or 0
+
+    def mark_exhausted(self, api_key):
+        """额度用完：当天不再分配该 Key"""
+        with _key_states_lock:
+            self._state(api_key).exhausted_day = date.today()
+
+    def status(self):
+        """各 Key 的负载与额度概况（Key 只显示指纹）"""
+        quota = DAILY_PAGE_QUOTA.get(self.engine)
+        rows = []
+        with _key_states_lock:
+            for api_key in self.keys:
+                state = self._state(api_key)
+                rows.append({
+                    "key": key_fingerprint(api_key),
+                    "active": state.active,
+                    "used_pages": state.used_pages,
+                    "quota": quota,
+                    "exhausted": state.exhausted_day == date.today(),
+                    "throttled": get_limiter(self.engine, api_key).throttled_for() > 0,
+                })
+        return rows
+
+
+# =========================================================
+# 重试 / 超时 / 熔断
+# =========================================================
+# 两个客户端的接口调用、对象存储上传下载和状态轮询共用同一层保护：
+#   - 网络异常、5xx、429 按指数退避 + 随机抖动重试，不再每秒死循环；
+#   - 每个阶段（提交 / 解析 / 导出 / 下载）有自己的超时，整个任务另有总预算，取两者中先到的；
+#   - 每个引擎一个熔断器：连续失败（每次调用重试用尽后计一次）达到阈值后直接失败，冷却期过后放一个试探请求，成功即恢复；
+#     已提交任务的状态查询遇到熔断时跳过这一轮，等熔断恢复后继续查询，不判任务失败。
+# 服务商整体故障时任务会快速失败并释放槽位，而不是一直占着 worker。
+
+# 单次 HTTP 请求超时（秒）
+REQUEST_TIMEOUT = float(os.environ.get("PDF_REQUEST_TIMEOUT", 30))
+
+# 各阶段超时（秒）
+STAGE_TIMEOUTS = {
+    "submit": float(os.environ.get("PDF_SUBMIT_TIMEOUT", 300)),
+    "parse": float(os.environ.get("PDF_PARSE_TIMEOUT", 1800)),
+    "export": float(os.environ.get("PDF_EXPORT_TIMEOUT", 300)),
+    "download": float(os.environ.get("PDF_DOWNLOAD_TIMEOUT", 600)),
+}
+
+# 单个任务（上传到下载完成）的总预算（秒）
+JOB_TIMEOUT_SECONDS = float(os.environ.get("PDF_JOB_TIMEOUT", 3600))
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("PDF_BREAKER_THRESHOLD", 5))
+BREAKER_RESET_SECONDS = float(os.environ.get("PDF_BREAKER_RESET", 60))
+
+
+class DeadlineExceededError(Exception):
+    pass
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class JobCancelledError(Exception):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds, label="任务", parent=None):
+        self.label = label
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+        # 子阶段与所属任务共用取消标记和取消通知
+        self._cancelled = parent._cancelled if parent else threading.Event()
+        self._on_cancel = parent._on_cancel if parent else []
+        self._on_cancel_lock = parent._on_cancel_lock if parent else threading.Lock()
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def cancel(self):
+        """放弃该任务：之后的 check / sleep 以及进行中的重试都会抛出 JobCancelledError"""
+        with self._on_cancel_lock:
+            self._cancelled.set()
+            callbacks = list(self._on_cancel)
+        for callback in callbacks: callback()
+
+    def add_cancel_callback(self, callback):
+        """取消时调用 callback()（已取消则立即调用），供不在本线程等待的一方及时醒来"""
+        with self._on_cancel_lock:
+            if not self._cancelled.is_set():
+                self._on_cancel.append(callback)
+                return
+        callback()
+
+    def remove_cancel_callback(self, callback):
+        with self._on_cancel_lock:
+            if callback in self._on_cancel: self._on_cancel.remove(callback)
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check(self):
+        if self.cancelled: raise JobCancelledError(f"{self.label}已取消")
+        if self.expired(): raise DeadlineExceededError(f"{self.label}超时（{self.seconds:.0f} 秒）")
+
+    def stage(self, stage, label):
+        """子阶段的截止时间：阶段超时与剩余总预算取先到者"""
+        seconds = STAGE_TIMEOUTS[stage]
+        return Deadline(seconds, label, parent=self) if seconds < self.remaining() else self
+
+    def fork(self):
+        """共用剩余预算、但可以单独取消的副本（对冲解析的两个分支各持一个）"""
+        return Deadline(self.remaining(), self.label)
+
+    def sleep(self, seconds):
+        """睡眠但不越过截止时间，被取消时立即醒来；醒来后检查是否已超时"""
+        self._cancelled.wait(min(seconds, self.remaining()))
+        self.check()
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        """第 attempt 次失败后的等待时间：指数退避，full jitter"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+DEFAULT_RETRY = RetryPolicy()
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def before_call(self):
+        """熔断打开时直接抛出 CircuitOpenError；冷却期过后只放行一个试探请求"""
+        with self._lock:
+            if self.state == self.OPEN:
+                wait = self._opened_at + self.reset_seconds - time.monotonic()
+                if wait > 0: raise CircuitOpenError(f"{self.name} 服务暂不可用（已熔断，约 {wait:.0f} 秒后重试）")
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN:
+                if self._probing: raise CircuitOpenError(f"{self.name} 服务暂不可用（正在试探恢复）")
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(engine):
+    """取得引擎对应的共享熔断器（同一服务商的所有 Key 共用）"""
+    with _breakers_lock:
+        if engine not in _breakers:
+            _breakers[engine] = CircuitBreaker(engine)
+        return _breakers[engine]
+
+
+def _is_transient(response):
+    return response.status_code == 429 or response.status_code >= 500
+
+
+def guarded_request(method, url, limiter=None, breaker=None, deadline=None, policy=DEFAULT_RETRY, session=None, **kwargs):
+    """带重试的 HTTP 请求
+
+    网络异常、429 和 5xx 按 policy 退避重试；重试用尽时，最后一次是响应就原样返回交给调用方处理，
+    是异常就抛出。data 可以传一个返回文件对象的函数，每次重试重新打开（上传文件流用）。
+    limiter 为接口限流器（对象存储链接不传），breaker 为引擎熔断器，session 为共享连接池 (get_session)。
+    """
+    http = session or requests
+    kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+    data_factory = kwargs.pop("data") if callable(kwargs.get("data")) else None
+    attempt = 0
+    while True:
+        if deadline: deadline.check()
+        if breaker: breaker.before_call()
+        if limiter: limiter.acquire()
+        body = data_factory() if data_factory else None
+        error, res = None, None
+        try:
+            if body is not None: kwargs["data"] = body
+            res = http.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            error = e
+        finally:
+            if body is not None and hasattr(body, "close"): body.close()
+
+        if res is not None and not _is_transient(res):
+            if breaker: breaker.record_success()
+            return res
+        throttled = res is not None and res.status_code == 429
+        if throttled:
+            # 限流说明服务在线，不计入熔断
+            if limiter: limiter.throttle(res)
+            if breaker: breaker.record_success()
+        elif breaker and breaker.state == breaker.HALF_OPEN:
+            # 试探请求失败，立即重新熔断
+            breaker.record_failure()
+
+        attempt += 1
+        if attempt >= policy.max_attempts:
+            # 一次调用重试用尽才算一次失败，单个请求的重试不会把整个引擎熔断
+            if breaker and not throttled and breaker.state != breaker.OPEN: breaker.record_failure()
+            if res is not None: return res
+            raise Exception(f"网络请求失败（已重试 {attempt} 次）: {error}")
+        wait = policy.delay(attempt)
+        if deadline: deadline.sleep(wait)
+        else: time.sleep(wait)
+
+
+# =========================================================
+# HTTP 连接池
+# =========================================================
+# 每个引擎一个进程级 requests.Session（模块级单例，跨任务、跨 Streamlit rerun 复用）：
+# 接口调用、状态轮询和对象存储上传下载都走 keep-alive 连接，不再每次轮询重新握手。
+# 连接池按主机划分：connections 为缓存连接池的主机数，maxsize 为每个主机最多保留的空闲连接数，
+# 并发超过 maxsize 时照常新建连接，只是用完后不放回池中。
+
+HTTP_POOL = {
+    "connections": int(os.environ.get("PDF_HTTP_POOL_CONNECTIONS", 4)),
+    "maxsize": int(os.environ.get("PDF_HTTP_POOL_MAXSIZE", 16)),
+}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _mount_pool(session):
+    # 调用方需持有 _sessions_lock
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL["connections"], pool_maxsize=HTTP_POOL["maxsize"])
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+
+def get_session(engine):
+    """取得引擎对应的共享 Session（所有 Key、所有线程共用）"""
+    with _sessions_lock:
+        if engine not in _sessions:
+            session = requests.Session()
+            _mount_pool(session)
+            _sessions[engine] = session
+        return _sessions[engine]
+
+
+def configure_http_pool(connections=None, maxsize=None):
+    """调整连接池大小；已有 Session 换上新的连接池，进行中的请求继续使用旧连接直到结束"""
+    with _sessions_lock:
+        if connections is not None: HTTP_POOL["connections"] = max(1, int(connections))
+        if maxsize is not None: HTTP_POOL["maxsize"] = max(1, int(maxsize))
+        for session in _sessions.values():
+            _mount_pool(session)
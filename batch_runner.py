@@ -0,0 +1,195 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# =========================================================
+# 后台批量执行器（进程级公平调度）
+# =========================================================
+# 与 Streamlit 无关的纯 Python 对象，由 main-two.py 通过 st.cache_resource
+# 保存为进程级单例，所有浏览器会话共用，可以跨越脚本 rerun 和浏览器刷新继续运行。
+#
+# 调度规则：
+#   - 全局最多同时运行 max_concurrency 个任务（解析请求 + pandoc 进程），主机不会超载；
+#   - 每个会话 (run_id) 有自己的队列和并发上限；
+#   - 有空闲槽位时按会话轮转取任务，500 个文件的批次不会饿死别人排队的单个文件；
+#   - 会话内可选 FIFO 或短作业优先 (SJF)：SJF 按估算代价（页数）挑最小的任务，
+#     并随等待时间降低有效代价 (aging)，大文件最终也会被调度到。
+# 工作线程只写本对象内部的任务表，UI 通过 snapshot() / stats() 轮询读取。
+
+JOB_QUEUED = "待处理"
+JOB_RUNNING = "处理中"
+JOB_DONE = "已完成"
+JOB_FAILED = "失败"
+
+POLICY_FIFO = "fifo"
+POLICY_SJF = "sjf"
+
+# aging：每等待 1 秒，有效代价减少的页数。800 页的书最多被短任务插队约 800 / 0.5 秒
+DEFAULT_AGING_RATE = 0.5
+
+
+def effective_cost(cost, waited_seconds, aging_rate=DEFAULT_AGING_RATE):
+    """SJF 有效代价：估算代价减去等待带来的补偿；未知代价按 0 处理"""
+    return (cost or 0.0) - aging_rate * waited_seconds
+
+
+class BatchRunner:
+    def __init__(self, max_threads=8, aging_rate=DEFAULT_AGING_RATE):
+        self.max_concurrency = max(1, int(max_threads))
+        self.aging_rate = aging_rate
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="batch-runner")
+        self._lock = threading.Lock()
+        self._runs = {}        # run_id -> {"queue": deque, "running": int, "limit": int, "policy": str}
+        self._jobs = {}        # run_id -> {job_id: job_dict}
+        self._order = deque()  # 会话轮转顺序
+        self._running_total = 0
+
+    def submit(self, run_id, job_info, fn, *args, limit=1, cost=None, policy=POLICY_FIFO):
+        """提交一个任务到指定会话；该会话最多同时运行 limit 个任务
+
+        job_info 是可序列化的文件描述（id/name/size 等），用于刷新后恢复列表；
+        fn(*args) 需返回 (job_id, {"success", "error", "result_path"})。
+        cost 为估算代价（页数），policy 为 POLICY_SJF 时用于排序。
+        """
+        job_id = job_info["id"]
+        with self._lock:
+            run = self._get_run(run_id)
+            run["limit"] = max(1, int(limit))
+            run["policy"] = policy
+            self._jobs[run_id][job_id] = {
+                **job_info,
+                "status": JOB_QUEUED,
+                "error_msg": None,
+                "result_path": None,
+                "updated": time.time(),
+            }
+            run["queue"].append((job_id, fn, args, cost, time.time()))
+            self._pump()
+
+    @contextmanager
+    def slot(self, run_id):
+        """在当前线程占用一个全局槽位（例如单文件模式的前台解析），与批量任务一起公平排队"""
+        granted = threading.Event()
+        released = threading.Event()
+
+        def hold():
+            granted.set()
+            released.wait()
+            return None, {"success": True, "error": None, "result_path": None}
+
+        with self._lock:
+            run = self._get_run(run_id)
+            # 前台请求插到本会话队首（SJF 下代价为负无穷）：用户正在页面上等待
+            run["queue"].appendleft((None, hold, (), float("-inf"), time.time()))
+            self._pump()
+        granted.wait()
+        try:
+            yield
+        finally:
+            released.set()
+
+    def _get_run(self, run_id):
+        # 调用方需持有 self._lock
+        if run_id not in self._runs:
+            self._runs[run_id] = {"queue": deque(), "running": 0, "limit": 1, "policy": POLICY_FIFO}
+            self._jobs[run_id] = {}
+            self._order.append(run_id)
+        return self._runs[run_id]
+
+    def _next_item(self):
+        # 调用方需持有 self._lock；按轮转顺序找第一个有排队任务且未达上限的会话
+        for _ in range(len(self._order)):
+            run_id = self._order[0]
+            self._order.rotate(-1)
+            run = self._runs[run_id]
+            if run["queue"] and run["running"] < run["limit"]:
+                return run_id, self._pop_job(run)
+        return None
+
+    def _pop_job(self, run):
+        # 调用方需持有 self._lock
+        queue = run["queue"]
+        if run["policy"] != POLICY_SJF:
+            return queue.popleft()
+        now = time.time()
+        best = min(range(len(queue)), key=lambda i: effective_cost(queue[i][3], now - queue[i][4], self.aging_rate))
+        item = queue[best]
+        del queue[best]
+        return item
+
+    def _pump(self):
+        # 调用方需持有 self._lock
+        while self._running_total < self.max_concurrency:
+            item = self._next_item()
+            if item is None: break
+            run_id, (job_id, fn, args, _, _) = item
+            self._runs[run_id]["running"] += 1
+            self._running_total += 1
+            self._set(run_id, job_id, status=JOB_RUNNING)
+            self._executor.submit(self._execute, run_id, job_id, fn, args)
+
+    def _execute(self, run_id, job_id, fn, args):
+        try:
+            _, res = fn(*args)
+        except Exception as e:
+            res = {"success": False, "error": str(e), "result_path": None}
+        with self._lock:
+            if res["success"]:
+                self._set(run_id, job_id, status=JOB_DONE, result_path=res["result_path"])
+            else:
+                self._set(run_id, job_id, status=JOB_FAILED, error_msg=res["error"])
+            self._runs[run_id]["running"] -= 1
+            self._running_total -= 1
+            self._pump()
+
+    def _set(self, run_id, job_id, **fields):
+        job = self._jobs.get(run_id, {}).get(job_id)
+        if job is None: return
+        job.update(fields)
+        job["updated"] = time.time()
+
+    def snapshot(self, run_id):
+        """返回会话内所有任务的副本 {job_id: job_dict}"""
+        with self._lock:
+            return {job_id: dict(job) for job_id, job in self._jobs.get(run_id, {}).items()}
+
+    def stats(self, run_id=None):
+        """全局调度概况；给出 run_id 时附带该会话自己的排队 / 运行数"""
+        with self._lock:
+            busy = [r for r in self._runs.values() if r["queue"] or r["running"]]
+            info = {
+                "capacity": self.max_concurrency,
+                "running": self._running_total,
+                "queued": sum(len(r["queue"]) for r in self._runs.values()),
+                "sessions": len(busy),
+            }
+            run = self._runs.get(run_id)
+            info["own_running"] = run["running"] if run else 0
+            info["own_queued"] = len(run["queue"]) if run else 0
+            return info
+
+    def is_active(self, run_id):
+        with self._lock:
+            run = self._runs.get(run_id)
+            return bool(run and (run["queue"] or run["running"]))
+
+    def active_job_ids(self):
+        """所有会话中排队或运行中的任务 ID"""
+        with self._lock:
+            return {
+                job_id
+                for jobs in self._jobs.values()
+                for job_id, job in jobs.items()
+                if job["status"] in (JOB_QUEUED, JOB_RUNNING)
+            }
+
+    def forget(self, run_id):
+        """丢弃已结束会话的记录（运行中的任务不受影响）"""
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run and (run["queue"] or run["running"]): return
+            self._runs.pop(run_id, None)
+            self._jobs.pop(run_id, None)
+            if run_id in self._order: self._order.remove(run_id)
@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+
+# =========================================================
+# 完成回调接收器
+# =========================================================
+# 提交解析任务时把回调地址交给服务商（目前 MinerU 支持），任务完成后服务商 POST 通知，
+# 这里收到通知就唤醒对应任务立即查询一次结果，而不必等到下一次轮询。
+# 回调内容本身不被信任：只用来触发查询，结果仍以接口返回为准；轮询保留为兜底，
+# 回调丢失（网络不通、服务重启）时任务照样能完成，只是慢一些。
+#
+# 需要服务商能访问到本机：
+#   PDF_CALLBACK_URL   对外可访问的地址，如 https://example.com:8765（未设置则不启用回调）
+#   PDF_CALLBACK_BIND  本地监听地址，默认 0.0.0.0:8765
+# 每个回调地址带一个随机令牌，过期后自动注销。
+
+CALLBACK_PUBLIC_URL = os.environ.get("PDF_CALLBACK_URL", "").rstrip("/")
+CALLBACK_BIND = os.environ.get("PDF_CALLBACK_BIND", "0.0.0.0:8765")
+# 令牌有效期（秒），与单个任务的总预算相当
+CALLBACK_TTL_SECONDS = float(os.environ.get("PDF_CALLBACK_TTL", 3600))
+
+
+class CallbackReceiver:
+    def __init__(self, public_url, bind=CALLBACK_BIND, ttl=CALLBACK_TTL_SECONDS):
+        self.public_url = public_url.rstrip("/")
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._handlers = {}  # token -> (on_callback, 过期时间)
+        host, _, port = bind.rpartition(":")
+        self._server = ThreadingHTTPServer((host or "0.0.0.0", int(port)), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="callback-receiver", daemon=True)
+        self._thread.start()
+
+    def register(self, on_callback):
+        """登记一个回调，返回 (回调地址, 令牌)；on_callback(body) 在接收线程中调用"""
+        token = secrets.token_urlsafe(16)
+        now = time.time()
+        with self._lock:
+            for expired in [t for t, (_, until) in self._handlers.items() if until < now]:
+                del self._handlers[expired]
+            self._handlers[token] = (on_callback, now + self.ttl)
+        return f"{self.public_url}/callback/{token}", token
+
+    def unregister(self, token):
+        with self._lock:
+            self._handlers.pop(token, None)
+
+    def dispatch(self, token, body):
+        """处理一次回调通知，令牌未登记（或已过期）返回 False"""
+        with self._lock:
+            entry = self._handlers.get(token)
+        if entry is None or entry[1] < time.time(): return False
+        entry[0](body)
+        return True
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _make_handler(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                parts = urlparse(self.path).path.strip("/").split("/")
+                ok = len(parts) == 2 and parts[0] == "callback" and receiver.dispatch(parts[1], body)
+                self.send_response(200 if ok else 404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+        return Handler
+
+
+_receiver = None
+_receiver_failed = False
+_receiver_lock = threading.Lock()
+
+
+def get_callback_receiver():
+    """进程级共享的接收器；未配置 PDF_CALLBACK_URL 或端口无法监听时返回 None（只用轮询）"""
+    global _receiver, _receiver_failed
+    if not CALLBACK_PUBLIC_URL: return None
+    with _receiver_lock:
+        if _receiver is None and not _receiver_failed:
+            try:
+                _receiver = CallbackReceiver(CALLBACK_PUBLIC_URL)
+            except OSError:
+                # 例如同一台机器上的第二个进程：端口已被占用，退回轮询
+                _receiver_failed = True
+        return _receiver
+
+
+# =========================================================
+# 本地自检：用一个模拟服务商验证回调链路
+# =========================================================
+SEED_PATTERN = re.compile(r'^[A-Za-z0-9_]{1,64}$')
+
+
+class _StandinProvider:
+    """模拟 MinerU 的 /file-urls/batch 接口：记下提交内容，返回固定的 batch_id"""
+
+    BATCH_ID = "standin-batch"
+
+    def __init__(self):
+        self.requests = []
+        provider = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                provider.requests.append((self.path, json.loads(self.rfile.read(length) or b"{}")))
+                body = json.dumps({"code": 0, "data": {
+                    "batch_id": provider.BATCH_ID, "file_urls": [f"{provider.base_url}/upload/0"],
+                }}).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def self_test(fallback=10.0, delay=0.5):
+    """模拟服务商在 delay 秒后完成任务并 POST 回调，检查等待方在兜底轮询 (fallback 秒) 之前被唤醒
+
+    走真实的提交路径：MinerUOnlineClient._request_upload_urls 向模拟的 /file-urls/batch 提交，
+    检查提交里的 callback / seed，再由模拟服务商 POST 回调 → dispatch → 唤醒该 batch_id 的轮询。
+    返回 (是否通过, 说明)。
+    """
+    # 直接运行本文件时这里是 __main__，提交路径用的是导入的 callback_receiver 模块里的单例
+    import callback_receiver as registry
+    from pdf_pipeline import MinerUOnlineClient
+    from status_poller import get_status_poller
+
+    provider = _StandinProvider()
+    receiver = CallbackReceiver("http://127.0.0.1", bind="127.0.0.1:0")
+    receiver.public_url = f"http://127.0.0.1:{receiver._server.server_address[1]}"
+    saved = registry._receiver, registry.CALLBACK_PUBLIC_URL
+    registry._receiver, registry.CALLBACK_PUBLIC_URL = receiver, receiver.public_url
+    try:
+        client = MinerUOnlineClient("standin-key")
+        client.base_url = f"{provider.base_url}/api/v4"
+        _, batch_id = client._request_upload_urls(["standin.pdf"])
+        path, submitted = provider.requests[-1]
+        callback, seed = submitted.get("callback", ""), str(submitted.get("seed", ""))
+        if path != "/api/v4/file-urls/batch" or batch_id != provider.BATCH_ID:
+            return False, f"提交路径或 batch_id 不符: {path} {batch_id}"
+        if not callback.startswith(f"{receiver.public_url}/callback/"):
+            return False, f"提交的回调地址不符: {callback!r}"
+        if not SEED_PATTERN.match(seed) or seed in callback:
+            return False, f"seed 不合规或与回调地址中的令牌重复: {seed!r}"
+
+        # 第一次查询按下限立即发出，之后每 fallback 秒兜底查一次；只有回调唤醒才能提前拿到结果
+        remote = {"state": "running"}
+        polls = iter([0.0] + [fallback] * 1000)
+        future = get_status_poller().watch(
+            lambda: (remote["state"] == "done", remote["state"]), lambda: next(polls), key=("mineru", batch_id)
+        )
+
+        def finish():
+            time.sleep(delay)
+            remote["state"] = "done"
+            body = json.dumps({"batch_id": batch_id, "state": "done"}).encode("utf-8")
+            urlopen(Request(callback, data=body, headers={"Content-Type": "application/json"}), timeout=5).close()
+
+        started = time.monotonic()
+        threading.Thread(target=finish, daemon=True).start()
+        future.result(timeout=fallback * 2 + delay)
+        elapsed = time.monotonic() - started
+        if elapsed >= fallback: return False, f"回调没有唤醒轮询：{elapsed:.2f} 秒才拿到结果"
+        return True, f"回调后 {elapsed:.2f} 秒拿到结果（兜底轮询间隔 {fallback:.0f} 秒），seed={seed}"
+    finally:
+        registry._receiver, registry.CALLBACK_PUBLIC_URL = saved
+        receiver.close()
+        provider.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="完成回调接收器本地自检（不访问外网）")
+    parser.add_argument("--fallback", type=float, default=10.0, help="模拟的兜底轮询间隔（秒）")
+    parser.add_argument("--delay", type=float, default=0.5, help="模拟服务商完成任务所需时间（秒）")
+    args = parser.parse_args()
+    ok, message = self_test(args.fallback, args.delay)
+    print(f"{'通过' if ok else '失败'}：{message}")
+    raise SystemExit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
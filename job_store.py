@@ -0,0 +1,233 @@
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from batch_runner import JOB_QUEUED, JOB_RUNNING, POLICY_FIFO, POLICY_SJF, DEFAULT_AGING_RATE
+
+# =========================================================
+# 持久化任务日志 (SQLite)
+# =========================================================
+# 记录每个批量任务走到了哪个阶段以及远端 ID (Doc2X uid / MinerU batch_id)，
+# 服务重启或会话重置后可以从最后完成的阶段继续，而不必重新上传、重新解析。
+# 每次操作使用独立连接，多线程 / 多进程共用同一个数据库文件都是安全的。
+# 同时充当独立 worker (pdf_worker.py) 的共享队列：executor 为 "worker" 的任务
+# 由 claim_next_job 原子领取，worker 定期写 heartbeat，超时未续约的任务会被其他 worker 接手。
+
+STAGE_UPLOADED = "uploaded"                # PDF 已保存到本地
+STAGE_PARSE_SUBMITTED = "parse_submitted"  # 已上传到解析引擎，拿到远端 ID
+STAGE_PARSE_DONE = "parse_done"            # 引擎解析完成
+STAGE_EXPORTED = "exported"                # 结果包已就绪，拿到下载链接
+STAGE_DOWNLOADED = "downloaded"            # 结果包已下载并解压
+STAGE_CONVERTED = "converted"              # Word / EPUB 已生成
+
+STAGES = [
+    STAGE_UPLOADED, STAGE_PARSE_SUBMITTED, STAGE_PARSE_DONE,
+    STAGE_EXPORTED, STAGE_DOWNLOADED, STAGE_CONVERTED,
+]
+
+EXECUTOR_LOCAL = "local"    # 由 Streamlit 进程内的 BatchRunner 执行
+EXECUTOR_WORKER = "worker"  # 由独立 worker 进程从队列领取
+
+# worker 超过该时长未续约，视为已崩溃，其任务可被重新领取
+WORKER_LEASE_SECONDS = 120
+
+
+def stage_reached(current, target):
+    """current 阶段是否已经达到（或越过）target 阶段"""
+    if current not in STAGES: return False
+    return STAGES.index(current) >= STAGES.index(target)
+
+
+class JobStore:
+    def __init__(self, db_path="./batch_jobs.db"):
+        self.db_path = str(Path(db_path))
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    run_id TEXT,
+                    name TEXT,
+                    size INTEGER,
+                    upload_time TEXT,
+                    pdf_path TEXT,
+                    engine TEXT,
+                    options TEXT,
+                    status TEXT,
+                    stage TEXT,
+                    remote_id TEXT,
+                    download_url TEXT,
+                    result_path TEXT,
+                    error_msg TEXT,
+                    created REAL,
+                    updated REAL
+                )
+            """)
+            # 旧版本数据库补齐队列相关字段
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for name, ddl in (
+                ("executor", f"TEXT DEFAULT '{EXECUTOR_LOCAL}'"), ("worker_id", "TEXT"),
+                ("heartbeat", "REAL"), ("cost", "REAL"), ("key_id", "TEXT"), ("saved_bytes", "INTEGER"),
+            ):
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {ddl}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (executor, status, created)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS workers (
+                    id TEXT PRIMARY KEY,
+                    host TEXT,
+                    pid INTEGER,
+                    concurrency INTEGER,
+                    started REAL,
+                    heartbeat REAL
+                )
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn: yield conn  # 正常退出时提交，异常时回滚
+        finally:
+            conn.close()
+
+    def _row_to_job(self, row):
+        job = dict(row)
+        job["options"] = json.loads(job["options"] or "{}")
+        return job
+
+    def create_job(self, job_info, run_id, pdf_path, engine, options=None, executor=EXECUTOR_LOCAL, cost=None):
+        """登记新任务（文件已落盘，阶段记为 uploaded）；同 id 重复登记会覆盖旧记录
+
+        cost 为估算解析代价（页数），供短作业优先调度使用。
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, run_id, name, size, upload_time, pdf_path, engine, options, "
+                "status, stage, executor, cost, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_info["id"], run_id, job_info["name"], job_info["size"], job_info["upload_time"],
+                 str(pdf_path), engine, json.dumps(options or {}), JOB_QUEUED, STAGE_UPLOADED, executor, cost, now, now)
+            )
+
+    def record_stage(self, job_id, stage, remote_id=None, download_url=None, result_path=None, engine=None, key_id=None):
+        """记录已完成的阶段；None 字段保留原值。key_id 是提交所用 API Key 的指纹"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET stage = ?, remote_id = COALESCE(?, remote_id), "
+                "download_url = COALESCE(?, download_url), result_path = COALESCE(?, result_path), "
+                "engine = COALESCE(?, engine), key_id = COALESCE(?, key_id), updated = ? WHERE id = ?",
+                (stage, remote_id, download_url, result_path, engine, key_id, time.time(), job_id)
+            )
+
+    def record_saved_bytes(self, job_id, saved_bytes):
+        """记录上传前瘦身节省的字节数"""
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET saved_bytes = ?, updated = ? WHERE id = ?", (saved_bytes, time.time(), job_id))
+
+    def set_status(self, job_id, status, error_msg=None, result_path=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error_msg = ?, result_path = COALESCE(?, result_path), "
+                "updated = ? WHERE id = ?",
+                (status, error_msg, result_path, time.time(), job_id)
+            )
+
+    def get_job(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def get_jobs(self, job_ids):
+        job_ids = list(job_ids)
+        if not job_ids: return {}
+        placeholders = ",".join("?" * len(job_ids))
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT * FROM jobs WHERE id IN ({placeholders})", job_ids).fetchall()
+        return {row["id"]: self._row_to_job(row) for row in rows}
+
+    def list_jobs(self, run_id):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs WHERE run_id = ? ORDER BY created", (run_id,)).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def unfinished_jobs(self, executor=EXECUTOR_LOCAL):
+        """尚未完成也未失败的任务（可能正在运行，也可能因重启而中断）"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) AND executor = ? ORDER BY created",
+                (JOB_QUEUED, JOB_RUNNING, executor)
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    # ---------------------------------------------------------
+    # 共享队列 (供 pdf_worker.py 使用)
+    # ---------------------------------------------------------
+    def claim_next_job(self, worker_id, lease_seconds=WORKER_LEASE_SECONDS, policy=POLICY_FIFO, aging_rate=DEFAULT_AGING_RATE):
+        """原子领取一个排队中的 worker 任务；租约过期的运行中任务也会被重新领取
+
+        policy 为 POLICY_SJF 时按 代价 - aging_rate × 等待秒数 从小到大领取（与 BatchRunner 相同的规则）。
+        """
+        now = time.time()
+        if policy == POLICY_SJF:
+            order_by, order_args = "COALESCE(cost, 0) - ? * (? - created), created", (aging_rate, now)
+        else:
+            order_by, order_args = "created", ()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")  # 写锁，避免多个 worker 领到同一任务
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE executor = ? AND "
+                "(status = ? OR (status = ? AND COALESCE(heartbeat, 0) < ?)) "
+                f"ORDER BY {order_by} LIMIT 1",
+                (EXECUTOR_WORKER, JOB_QUEUED, JOB_RUNNING, now - lease_seconds, *order_args)
+            ).fetchone()
+            if not row: return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = ?, heartbeat = ?, updated = ? WHERE id = ?",
+                (JOB_RUNNING, worker_id, now, now, row["id"])
+            )
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+        return self._row_to_job(row)
+
+    def heartbeat(self, worker_id, job_ids=()):
+        """worker 续约：刷新自身心跳以及手上任务的租约"""
+        now = time.time()
+        job_ids = list(job_ids)
+        with self._connect() as conn:
+            conn.execute("UPDATE workers SET heartbeat = ? WHERE id = ?", (now, worker_id))
+            if job_ids:
+                placeholders = ",".join("?" * len(job_ids))
+                conn.execute(
+                    f"UPDATE jobs SET heartbeat = ? WHERE worker_id = ? AND id IN ({placeholders})",
+                    [now, worker_id, *job_ids]
+                )
+
+    def register_worker(self, worker_id, host, pid, concurrency):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO workers (id, host, pid, concurrency, started, heartbeat) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (worker_id, host, pid, concurrency, now, now)
+            )
+
+    def unregister_worker(self, worker_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+
+    def live_workers(self, lease_seconds=WORKER_LEASE_SECONDS):
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM workers WHERE heartbeat >= ? ORDER BY started", (time.time() - lease_seconds,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete_jobs(self, job_ids):
+        job_ids = list(job_ids)
+        if not job_ids: return
+        placeholders = ",".join("?" * len(job_ids))
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM jobs WHERE id IN ({placeholders})", job_ids)
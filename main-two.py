@@ -1,19 +1,25 @@
 import streamlit as st
 import os
-import time
-import requests
-import zipfile
 import shutil
-import subprocess
 import tempfile
-import re
 from pathlib import Path
 from datetime import datetime
 from enum import Enum
 import threading
 from queue import Queue
 import concurrent.futures  # ⭐ 新增：并发库
+import uuid
 import converter_tool
+from api_guard import ENGINE_LIMITS, HTTP_POOL, configure_engine_limits, configure_http_pool, KeyPool
+from batch_runner import BatchRunner, POLICY_FIFO, POLICY_SJF
+from job_store import JobStore, EXECUTOR_LOCAL, EXECUTOR_WORKER
+from pdf_pipeline import (
+    FormatConverter, DocumentStats, PdfSource, spool_pdf,
+    parse_with_key_pool, restore_cached_parse, select_engine, process_single_file_task, HEDGE_AFTER_SECONDS,
+    chunked_parse, should_split, PYPDF_AVAILABLE, SPLIT_THRESHOLD_PAGES, CHUNK_PAGES,
+    parse_page_ranges, trim_pdf, reparse_pages, locate_page_region, splice_markdown, slim_pdf,
+    resolve_force_ocr, LocalTextClient, LOCAL_OFF, LOCAL_AUTO, LOCAL_ALWAYS, JOB_OPTION_DEFAULTS, job_options,
+)
 
 # 引入比对模块
 try:
@@ -21,13 +27,6 @@ try:
 except ImportError:
     DocComparator = None
 
-# 尝试导入 PyPDF
-try:
-    import pypdf
-    PYPDF_AVAILABLE = True
-except ImportError:
-    PYPDF_AVAILABLE = False
-
 # =========================================================
 # 状态枚举
 # =========================================================
@@ -46,18 +45,32 @@ class BatchFileManager:
             st.session_state.batch_files = []
     
     def add_files(self, uploaded_files):
+        """立即把上传文件写入内容寻址的落盘目录，会话里只保留文件描述
+
+        与列表中已有文件内容完全相同的 PDF 只处理一次，返回被跳过的文件名列表。
+        """
+        known = {f.get("sha256") for f in st.session_state.batch_files}
+        skipped = []
         for file in uploaded_files:
+            sha256, pdf_path = spool_pdf(PdfSource.from_upload(file))
+            if sha256 in known:
+                skipped.append(file.name)
+                continue
+            known.add(sha256)
             file_info = {
                 "id": f"{file.name}_{datetime.now().timestamp()}",
                 "name": file.name,
                 "size": file.size,
                 "status": FileStatus.PENDING.value,
                 "upload_time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "file_obj": file,
+                "sha256": sha256,
+                "pdf_path": str(pdf_path),
+                "page_range": "",
                 "error_msg": None,
                 "result_path": None
             }
             st.session_state.batch_files.append(file_info)
+        return skipped
     
     def get_files_by_status(self, status):
         return [f for f in st.session_state.batch_files if f["status"] == status]
@@ -84,494 +97,235 @@ class BatchFileManager:
         ]
 
 # =========================================================
-# 1. Doc2X API 客户端 (⭐ 修改：增加 silent 参数支持多线程)
-# =========================================================
-class Doc2XPDFClient:
-    def __init__(self, api_key):
-        self.api_key = api_key
-        self.base_url = "https://v2.doc2x.noedgeai.com"
-        self.headers = {"Authorization": f"Bearer {api_key}"}
-
-    def process(self, file_path, silent=False):
-        uid, upload_url = self._preupload(silent)
-        self._upload_file(file_path, upload_url, silent)
-        self._wait_for_parsing(uid, silent)
-        self._trigger_export(uid, silent)
-        download_url = self._wait_for_export_result(uid)
-        return self._download_and_extract(download_url, file_path, silent)
-
-    def _preupload(self, silent=False):
-        if not silent: st.toast("1. 请求上传链接...", icon="☁️")
-        res = requests.post(f"{self.base_url}/api/v2/parse/preupload", headers=self.headers)
-        if res.status_code != 200: raise Exception(f"预上传失败: {res.text}")
-        data = res.json()
-        if data["code"] != "success": raise Exception(str(data))
-        return data["data"]["uid"], data["data"]["url"]
-
-    def _upload_file(self, file_path, upload_url, silent=False):
-        if not silent: st.toast("2. 上传文件...", icon="📤")
-        with open(file_path, "rb") as f:
-            requests.put(upload_url, data=f)
-
-    def _wait_for_parsing(self, uid, silent=False):
-        if not silent: st.toast("3. AI 正在解析...", icon="🧠")
-        
-        progress_text = None
-        bar = None
-        if not silent:
-            progress_text = st.empty()
-            bar = st.progress(0)
-            
-        while True:
-            time.sleep(1)
-            try:
-                res = requests.get(f"{self.base_url}/api/v2/parse/status", headers=self.headers, params={"uid": uid})
-                if res.status_code != 200: continue
-                data = res.json()
-                if data["code"] != "success": 
-                    if data.get("code") == "parse_error": raise Exception(data.get("msg"))
-                    continue
-                
-                status = data["data"]["status"]
-                prog = data["data"].get("progress", 0)
-                
-                if not silent and bar and progress_text:
-                    bar.progress(min(prog / 100, 1.0))
-                    progress_text.text(f"解析进度: {prog}%")
-                
-                if status == "success": 
-                    if not silent and bar:
-                        bar.progress(1.0)
-                        progress_text.empty()
-                    break
-                elif status == "failed": raise Exception(data["data"].get("detail"))
-            except requests.RequestException: continue
-
-    def _trigger_export(self, uid, silent=False):
-        if not silent: st.toast("4. 请求导出格式...", icon="⚙️")
-        requests.post(f"{self.base_url}/api/v2/convert/parse", headers=self.headers, 
-                      json={"uid": uid, "to": "md", "formula_mode": "normal", "filename": "output"})
-
-    def _wait_for_export_result(self, uid):
-        # 此处不涉及 UI，无需 silent
-        while True:
-            time.sleep(1)
-            res = requests.get(f"{self.base_url}/api/v2/convert/parse/result", headers=self.headers, params={"uid": uid})
-            if res.status_code != 200: continue
-            data = res.json()
-            if data["code"] == "success" and data["data"]["status"] == "success":
-                return data["data"]["url"]
-            elif data["data"]["status"] == "failed": raise Exception("导出失败")
-
-    def _download_and_extract(self, url, original_file, silent=False):
-        if not silent: st.toast("5. 下载资源包...", icon="📥")
-        r = requests.get(url)
-        extract_path = Path(f"./output/{original_file.stem}")
-        if extract_path.exists(): shutil.rmtree(extract_path)
-        extract_path.mkdir(parents=True, exist_ok=True)
-        
-        zip_path = extract_path / "result.zip"
-        with open(zip_path, 'wb') as f: f.write(r.content)
-        with zipfile.ZipFile(zip_path, 'r') as z: z.extractall(extract_path)
-        return extract_path
-
-# =========================================================
-# 2. MinerU 在线 API 客户端 (⭐ 修改：增加 silent 参数)
-# =========================================================
-class MinerUOnlineClient:
-    def __init__(self, api_key):
-        self.api_key = api_key
-        self.base_url = "https://mineru.net/api/v4"
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
-
-    def process(self, file_path, force_ocr=False, silent=False):
-        original_file = Path(file_path)
-        
-        if not silent: st.toast("1. 申请上传链接...", icon="🔗")
-        upload_url, batch_id = self._get_upload_url(original_file.name, force_ocr)
-        
-        if not silent: st.toast("2. 上传文件到解析中心...", icon="📤")
-        self._upload_file(file_path, upload_url)
-        
-        if not silent: st.toast("3. AI 正在解析...", icon="🧠")
-        download_url = self._wait_for_result(batch_id, original_file.name, silent)
-        
-        if not silent: st.toast("4. 下载解析结果...", icon="📥")
-        output_dir = self._download_and_extract(download_url, original_file)
-        
-        return output_dir
-
-    def _get_upload_url(self, filename, force_ocr=False):
-        url = f"{self.base_url}/file-urls/batch"
-        data = {
-            "files": [{"name": filename}],
-            "model_version": "vlm",
-            "enable_formula": True,
-            "enable_table": True,
-            "force_ocr": force_ocr
-        }
-        try:
-            res = requests.post(url, headers=self.headers, json=data, timeout=30)
-            if res.status_code != 200: raise Exception(f"申请上传链接失败: HTTP {res.status_code}")
-            result = res.json()
-            if result["code"] != 0: raise Exception(f"解析错误: {result.get('msg', '未知错误')}")
-            return result["data"]["file_urls"][0], result["data"]["batch_id"]
-        except requests.RequestException as e: raise Exception(f"网络请求失败: {str(e)}")
-
-    def _upload_file(self, file_path, upload_url):
-        try:
-            with open(file_path, 'rb') as f:
-                res = requests.put(upload_url, data=f, timeout=300)
-                if res.status_code != 200: raise Exception(f"文件上传失败: HTTP {res.status_code}")
-        except requests.RequestException as e: raise Exception(f"上传文件失败: {str(e)}")
-
-    def _wait_for_result(self, batch_id, filename, silent=False):
-        url = f"{self.base_url}/extract-results/batch/{batch_id}"
-        
-        progress_text = None
-        bar = None
-        if not silent:
-            progress_text = st.empty()
-            bar = st.progress(0)
-        
-        max_wait_time = 600
-        start_time = time.time()
-        
-        while True:
-            if time.time() - start_time > max_wait_time: raise Exception("解析超时")
-            time.sleep(3)
-            
-            try:
-                res = requests.get(url, headers=self.headers, timeout=30)
-                if res.status_code != 200: continue
-                result = res.json()
-                if result["code"] != 0: continue
-                
-                extract_results = result["data"]["extract_result"]
-                file_result = next((r for r in extract_results if r["file_name"] == filename), None)
-                if not file_result: continue
-                
-                state = file_result["state"]
-                
-                if not silent and bar and progress_text:
-                    if state == "running":
-                        if "extract_progress" in file_result:
-                            prog = file_result["extract_progress"]
-                            extracted = prog.get("extracted_pages", 0)
-                            total = prog.get("total_pages", 1)
-                            percent = min(0.2 + (extracted / total) * 0.6, 0.8)
-                            bar.progress(percent)
-                            progress_text.text(f"解析中: {extracted}/{total} 页")
-                        else:
-                            bar.progress(0.5)
-                            progress_text.text("正在解析...")
-                    elif state == "done":
-                        bar.progress(1.0)
-                        progress_text.empty()
-
-                if state == "done":
-                    if not silent: st.toast("✅ 解析完成！", icon="🎉")
-                    return file_result["full_zip_url"]
-                elif state == "failed":
-                    err_msg = file_result.get("err_msg", "未知错误")
-                    raise Exception(f"解析失败: {err_msg}")
-                    
-            except requests.RequestException: continue
-
-    def _download_and_extract(self, download_url, original_file):
-        output_dir = Path(f"./output/{original_file.stem}")
-        if output_dir.exists(): shutil.rmtree(output_dir)
-        output_dir.mkdir(parents=True, exist_ok=True)
-        try:
-            r = requests.get(download_url, timeout=300)
-            zip_path = output_dir / "result.zip"
-            with open(zip_path, 'wb') as f: f.write(r.content)
-            with zipfile.ZipFile(zip_path, 'r') as z: z.extractall(output_dir)
-            zip_path.unlink()
-            return output_dir
-        except Exception as e: raise Exception(f"下载结果失败: {str(e)}")
-
-# =========================================================
-# 3. 格式转换器 (修正路径错误)
+# ⭐ 修改：批量处理逻辑 (后台执行器，不阻塞脚本线程)
 # =========================================================
-class FormatConverter:
-    @staticmethod
-    def save_md_content(content, path):
-        with open(path, "w", encoding="utf-8") as f:
-            f.write(content)
-
-    @staticmethod
-    def get_md_file_path(folder):
-        md_files = list(folder.glob("**/auto/*.md"))
-        if not md_files: md_files = list(folder.glob("**/output.md"))
-        if not md_files: md_files = list(folder.glob("**/*.md"))
-        return md_files[0] if md_files else None
-
-    @staticmethod
-    def normalize_math_formulas(md_content):
-        if not md_content: return ""
-        md_content = re.sub(r'\\\(\s*', '$', md_content)
-        md_content = re.sub(r'\s*\\\)', '$', md_content)
-        md_content = re.sub(r'\\\[\s*', '\n$$\n', md_content)
-        md_content = re.sub(r'\s*\\\]', '\n$$\n', md_content)
-        return md_content
-
-    @staticmethod
-    def clean_image_captions(md_content):
-        if not md_content: return ""
-        return re.sub(r'!\[([^\]]*)\]\(([^\)]+)\)', r'![](\2)', md_content)
-
-    @staticmethod
-    def run_pandoc(input_file, output_file, format_type, source_filename=None, math_mode="mathml"):
-        # 强制转换为绝对路径，解决路径查找问题
-        input_path = Path(input_file).resolve()
-        cwd = input_path.parent
-        
-        temp_input = None
-        css_file = None 
-
-        # 预处理 MD
-        if input_path.suffix.lower() == '.md':
-            with open(input_path, 'r', encoding='utf-8') as f: content = f.read()
-            content = FormatConverter.normalize_math_formulas(content)
-            content = FormatConverter.clean_image_captions(content)
-            
-            # 临时文件创建在同一目录下
-            temp_input = cwd / f"temp_fix_{input_path.name}"
-            with open(temp_input, 'w', encoding='utf-8') as f: f.write(content)
-            # 传递给命令时使用文件名即可（因为设置了 cwd）
-            target_input = temp_input.name
-        else:
-            target_input = input_path.name
-
-        # 输出路径必须是绝对路径
-        cmd = ["pandoc", target_input, "-o", str(output_file.resolve())]
-        
-        if format_type == "epub":
-            title = Path(source_filename).stem if source_filename else input_path.stem
-            metadata_file = cwd / "metadata.yaml"
-            with open(metadata_file, "w", encoding="utf-8") as f:
-                f.write(f"---\ntitle: {title}\n---\n")
-            
-            css_file = cwd / "epub_fix.css"
-            with open(css_file, "w", encoding="utf-8") as f:
-                f.write("h1, h2, h3 { page-break-before: avoid !important; break-before: avoid !important; }")
-
-            cmd.extend([
-                "--standalone", "--toc",
-                # ⭐ 关键修改：使用 .resolve() 传递绝对路径
-                "--metadata-file", str(metadata_file.resolve()),
-                "--css", str(css_file.resolve()), 
-                "-f", "markdown+tex_math_dollars"
-            ])
-
-            if math_mode == "mathml": cmd.append("--mathml")
-            elif math_mode == "webtex": cmd.append("--webtex")
-            elif math_mode == "mathjax": cmd.append("--mathjax")
-            
-        elif format_type == "docx":
-            cmd.extend(["--standalone", "-f", "markdown+tex_math_dollars"])
-
-        cmd.append("--resource-path=.")
+DEFAULT_BATCH_WORKERS = 3
+MAX_BATCH_WORKERS = 8
+# 进程级全局并发上限（所有会话共享），可用环境变量调整
+GLOBAL_MAX_WORKERS = int(os.environ.get("PDF_GLOBAL_MAX_WORKERS", MAX_BATCH_WORKERS))
+BATCH_POLL_SECONDS = 2
+JOB_DB_PATH = Path("./batch_jobs.db")
+
+# 批量设置（侧边栏），在界面与提交函数之间整体传递
+DEFAULT_BATCH_SETTINGS = {
+    "workers": DEFAULT_BATCH_WORKERS,   # 本会话并发上限
+    "executor": EXECUTOR_LOCAL,         # 本机后台 / 独立 worker 队列
+    "policy": POLICY_FIFO,              # 会话内调度顺序
+    "hedge": False,                     # 两个引擎对冲解析
+    "use_cache": True,                  # 命中解析缓存时直接复用结果
+    "split": False,                     # 大文件分块并行解析
+    "slim": False,                      # 上传前无损瘦身
+    "local_mode": LOCAL_OFF,            # 本地文字层提取（不走云端）
+}
+
+@st.cache_resource
+def get_batch_runner():
+    """进程级后台执行器：所有会话共享，全局限流 + 按会话公平轮转"""
+    return BatchRunner(max_threads=GLOBAL_MAX_WORKERS)
+
+@st.cache_resource
+def get_job_store():
+    """持久化任务日志，服务重启后仍可续跑"""
+    return JobStore(JOB_DB_PATH)
+
+def get_batch_run_id():
+    """当前会话的批次 ID，同时写入 URL 参数，刷新页面后可重新挂接"""
+    if "batch_run_id" not in st.session_state:
+        st.session_state.batch_run_id = st.query_params.get("batch_run") or uuid.uuid4().hex[:12]
+    st.query_params["batch_run"] = st.session_state.batch_run_id
+    return st.session_state.batch_run_id
+
+def job_to_file_info(job):
+    """任务日志记录 -> BatchFileManager 文件条目"""
+    status = job["status"]
+    # 已提交但仍在排队的任务在界面上归入“处理中”
+    if status == FileStatus.PENDING.value: status = FileStatus.PROCESSING.value
+    return {
+        "id": job["id"],
+        "name": job["name"],
+        "size": job["size"],
+        "status": status,
+        "upload_time": job["upload_time"],
+        # 落盘文件按内容命名 (<sha256>.pdf)，恢复后仍能识别重复添加的相同文件
+        "sha256": Path(job["pdf_path"]).stem,
+        "pdf_path": job["pdf_path"],
+        "page_range": job["options"].get("page_range") or "",
+        "saved_bytes": job.get("saved_bytes"),
+        "error_msg": job["error_msg"],
+        "result_path": job["result_path"],
+    }
+
+def restore_batch_run():
+    """新会话（如刷新页面）时，从任务日志恢复同一批次的文件列表"""
+    run_id = st.query_params.get("batch_run")
+    if not run_id: return
+    jobs = get_job_store().list_jobs(run_id)
+    if not jobs: return
+    st.session_state.batch_run_id = run_id
+    st.session_state.batch_files = [job_to_file_info(job) for job in jobs]
+    st.session_state.work_mode = "batch"
+
+def submit_batch_job(job_info, api_key_doc2x, api_key_mineru, temp_dir, options, batch_settings, cost=None):
+    """提交到本机后台执行；options 为任务选项（与任务日志的 options 相同），batch_settings 只取并发与调度策略"""
+    runner = get_batch_runner()
+    runner.submit(
+        get_batch_run_id(), job_info,
+        process_single_file_task,
+        job_info, api_key_doc2x, api_key_mineru, temp_dir, get_job_store(), options,
+        limit=max(1, min(int(batch_settings["workers"]), MAX_BATCH_WORKERS)),
+        cost=cost, policy=batch_settings["policy"]
+    )
 
-        try:
-            # 运行 Pandoc
-            subprocess.run(cmd, cwd=cwd, check=True, capture_output=True, text=True)
-        except subprocess.CalledProcessError as e:
-            # 打印更详细的错误信息
-            raise Exception(f"Pandoc 转换失败 (路径: {cwd}): {e.stderr}")
-        finally:
-            # 清理临时文件
-            if temp_input and temp_input.exists(): temp_input.unlink()
-            if format_type == "epub":
-                if metadata_file.exists(): metadata_file.unlink()
-                if css_file and css_file.exists(): css_file.unlink()# ⭐ 清理 CSS
+def resume_batch_jobs(jobs, api_key_doc2x, api_key_mineru, batch_settings=DEFAULT_BATCH_SETTINGS):
+    """接管任务日志中未完成的任务：仍在本进程运行的直接挂接，已中断的按提交时的选项从最后完成阶段续跑"""
+    active_ids = get_batch_runner().active_job_ids()
+    known_ids = {f["id"] for f in st.session_state.batch_files}
+    for job in jobs:
+        if job["id"] not in known_ids:
+            st.session_state.batch_files.append(job_to_file_info(job))
+        if job["id"] in active_ids: continue
+        job_info = {k: job[k] for k in ("id", "name", "size", "upload_time")}
+        submit_batch_job(
+            job_info, api_key_doc2x, api_key_mineru, Path(job["pdf_path"]).parent, job["options"], batch_settings,
+            cost=job["cost"]
+        )
+    st.session_state.batch_jump_tab = "⚙️ 处理中"
 
-# =========================================================
-# 4. 文档统计工具
-# =========================================================
-class DocumentStats:
-    @staticmethod
-    def count_pdf_pages(pdf_path):
-        if not PYPDF_AVAILABLE: return None
-        try:
-            with open(pdf_path, 'rb') as f: return len(pypdf.PdfReader(f).pages)
-        except Exception: return None
-    
-    @staticmethod
-    def count_markdown_words(md_content):
-        if not md_content: return 0, 0, 0
-        md_content = re.sub(r'```[\s\S]*?```', '', md_content)
-        md_content = re.sub(r'\$\$[\s\S]*?\$\$', '', md_content)
-        chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', md_content))
-        english_words = len(re.findall(r'\b[a-zA-Z]+\b', md_content))
-        return chinese_chars + english_words, chinese_chars, english_words
-        
-# =========================================================
-# ⭐ 新增：多线程处理相关函数
-# =========================================================
+def process_batch_files(api_key_doc2x, api_key_mineru, force_ocr, math_mode, batch_settings=DEFAULT_BATCH_SETTINGS):
+    """将待处理文件提交到后台执行器后立即返回（本会话最多同时处理 batch_settings["workers"] 个文件）
 
-# =========================================================
-# ⭐ 修改：单文件任务处理 (支持保持原文件名)
-# =========================================================
-def process_single_file_task(file_info, api_key_doc2x, api_key_mineru, force_ocr, math_mode, temp_dir):
-    """单个文件的处理任务函数，运行在独立线程中"""
-    result = {"success": False, "error": None, "result_path": None}
-    
-    try:
-        # 1. 准备文件路径
-        pdf_path = temp_dir / file_info['name']
-        # 获取原始文件名（不含后缀），例如 "我的文档"
-        original_stem = Path(file_info['name']).stem
-        
-        # 2. 选择引擎
-        if api_key_mineru:
-            client = MinerUOnlineClient(api_key_mineru)
-            output_dir = client.process(pdf_path, force_ocr=force_ocr, silent=True)
-        elif api_key_doc2x:
-            client = Doc2XPDFClient(api_key_doc2x)
-            output_dir = client.process(pdf_path, silent=True)
-        else:
-            raise Exception("未配置 API Key")
+    executor 为 EXECUTOR_WORKER 时只写入共享队列，由独立 worker 进程 (pdf_worker.py) 领取执行；
+    policy 为 POLICY_SJF 时按估算页数短作业优先（带 aging）。
 
-        # 3. 查找并重命名 Markdown 文件
-        md_path = FormatConverter.get_md_file_path(output_dir)
-        if not md_path:
-            raise Exception("未找到 Markdown 文件")
-            
-        # ⭐ 核心修改：将提取出的 Markdown 重命名为原文件名
-        # 使用 with_name 保持在同一目录，确保图片相对路径不中断
-        new_md_path = md_path.with_name(f"{original_stem}.md")
-        
-        # 如果文件名不同，则重命名
-        if md_path != new_md_path:
-            # 如果目标文件已存在（极少情况），先删除
-            if new_md_path.exists():
-                new_md_path.unlink()
-            md_path.rename(new_md_path)
-            md_path = new_md_path # 更新变量指向新路径
-
-        # 4. 设置输出路径 (使用原文件名)
-        # 将生成的 Word 和 Epub 放在 output_dir 根目录下，方便查找
-        docx_path = output_dir / f"{original_stem}.docx"
-        epub_path = output_dir / f"{original_stem}.epub"
-        
-        # 5. 格式转换
-        # 转换 Word
-        FormatConverter.run_pandoc(md_path, docx_path, "docx")
-        
-        # 转换 Epub (带 CSS 修复)
-        FormatConverter.run_pandoc(
-            md_path, epub_path, "epub",
-            source_filename=file_info['name'], # 传递原文件名用于元数据
-            math_mode=math_mode
-        )
-        
-        result["success"] = True
-        result["result_path"] = str(output_dir)
-        
-    except Exception as e:
-        result["error"] = str(e)
-        
-    return file_info['id'], result
-    
-# =========================================================
-# ⭐ 修改：批量处理逻辑 (增加自动跳转)
-# =========================================================
-def process_batch_files(api_key_doc2x, api_key_mineru, force_ocr, math_mode):
-    """执行批量文件处理（单线程顺序版：上传完一个并处理好后，再处理下一个）"""
+    耗时主要在等待 Doc2X/MinerU 解析，并发让整批耗时接近最慢的几个文件。
+    工作线程把每个阶段写入任务日志 (JobStore)，由 render_batch_progress 轮询同步到 BatchFileManager。
+    """
     manager = BatchFileManager()
     pending_files = manager.get_files_by_status(FileStatus.PENDING.value)
     
     if not pending_files:
         st.warning("没有待处理的文件")
-        st.session_state.batch_processing = False
+        return
+    executor = batch_settings["executor"]
+    local_mode = batch_settings.get("local_mode", LOCAL_OFF)
+    # 自动模式下不是简单文字型的文件仍需云端引擎
+    if executor == EXECUTOR_LOCAL and local_mode != LOCAL_ALWAYS and not select_engine(api_key_doc2x, api_key_mineru):
+        st.error("请先在左侧填写 API Key（标准 或 期刊增强），或开启全部本地提取")
         return
 
-    # 创建临时目录
-    temp_dir = Path("./temp_uploads")
-    temp_dir.mkdir(exist_ok=True)
+    store = get_job_store()
+    run_id = get_batch_run_id()
+    engine = select_engine(api_key_doc2x, api_key_mineru, local_mode=local_mode)
     
-    # 状态提示区域
-    status_text = st.empty()
-    status_text.info("正在准备文件...")
-    
-    # 1. 准备工作：先将所有文件保存到本地临时目录，标记为处理中
-    ready_files = []
+    # 文件在加入列表时已落盘 (spool_pdf)，这里只登记并提交后台任务
     for file_info in pending_files:
-        try:
-            pdf_path = temp_dir / file_info['name']
-            if not pdf_path.exists():
-                with open(pdf_path, "wb") as f:
-                    f.write(file_info['file_obj'].getbuffer())
-            ready_files.append(file_info)
-            # 先全部标记为“处理中”，避免用户以为还在等待
-            manager.update_file_status(file_info['id'], FileStatus.PROCESSING.value)
-        except Exception as e:
-            manager.update_file_status(file_info['id'], FileStatus.FAILED.value, error_msg=f"文件读取失败: {e}")
-
-    # 切换视图到“处理中”
-    st.session_state.batch_active_tab = "⚙️ 处理中"
-    
-    # 进度条
-    progress_bar = st.progress(0)
-    total_files = len(ready_files)
-    
-    # 2. 顺序循环处理
-    for i, file_info in enumerate(ready_files):
-        current_num = i + 1
-        filename = file_info['name']
-        
-        # 更新UI提示：显示当前正在处理哪一个
-        status_text.markdown(f"🚀 **正在处理 ({current_num}/{total_files})**: `{filename}` ...")
+        pdf_path = Path(file_info['pdf_path'])
+        if not pdf_path.exists():
+            manager.update_file_status(file_info['id'], FileStatus.FAILED.value, error_msg="文件读取失败: 落盘文件已丢失")
+            continue
+        temp_dir = pdf_path.parent
         
-        # --- 调用原本的单任务处理函数 (直接在主线程运行) ---
-        # 注意：这里会阻塞，直到该文件上传、解析、转换全部完成
-        file_id, res = process_single_file_task(
-            file_info, api_key_doc2x, api_key_mineru, force_ocr, math_mode, temp_dir
-        )
-        
-        # 更新单个文件的状态
-        if res["success"]:
-            manager.update_file_status(file_id, FileStatus.COMPLETED.value, result_path=res["result_path"])
+        job_info = {k: file_info[k] for k in ("id", "name", "size", "upload_time")}
+        page_range = (file_info.get("page_range") or "").strip() or None
+        if page_range:
+            # 只解析所选页：提交前校验范围，调度代价按所选页数计
+            try:
+                cost = float(len(parse_page_ranges(page_range, DocumentStats.count_pdf_pages(pdf_path))))
+            except ValueError as e:
+                manager.update_file_status(file_info['id'], FileStatus.FAILED.value, error_msg=f"页码范围有误: {e}")
+                continue
         else:
-            manager.update_file_status(file_id, FileStatus.FAILED.value, error_msg=res["error"])
-        
-        # 更新总进度条
-        progress_bar.progress(current_num / total_files)
-    
-    # 全部完成后的收尾
-    status_text.success("🎉 所有文件处理完成！")
-    progress_bar.progress(1.0)
-    time.sleep(1.5) 
+            cost = DocumentStats.estimate_parse_cost(pdf_path)
+        # 侧边栏里属于任务选项的设置，连同 OCR / 公式格式 / 页码范围一起记入任务日志
+        options = job_options(
+            {k: v for k, v in batch_settings.items() if k in JOB_OPTION_DEFAULTS},
+            force_ocr=force_ocr, math_mode=math_mode, page_range=page_range
+        )
+        store.create_job(job_info, run_id, pdf_path, engine, options, executor=executor, cost=cost)
+        if executor == EXECUTOR_LOCAL:
+            submit_batch_job(job_info, api_key_doc2x, api_key_mineru, temp_dir, options, batch_settings, cost=cost)
+        manager.update_file_status(file_info['id'], FileStatus.PROCESSING.value)
+
+    # 切换视图到“处理中”
+    st.session_state.batch_jump_tab = "⚙️ 处理中"
+
+def sync_batch_run():
+    """把任务日志中的状态同步到 BatchFileManager，返回发生变化的文件数"""
+    manager = BatchFileManager()
+    jobs = get_job_store().get_jobs(f["id"] for f in st.session_state.batch_files)
+    changed = 0
+    for file in st.session_state.batch_files:
+        job = jobs.get(file["id"])
+        if not job: continue
+        synced = job_to_file_info(job)
+        file["saved_bytes"] = synced["saved_bytes"]
+        if synced["status"] == file["status"]: continue
+        manager.update_file_status(file["id"], synced["status"], error_msg=synced["error_msg"], result_path=synced["result_path"])
+        changed += 1
+    return changed
+
+@st.fragment(run_every=BATCH_POLL_SECONDS)
+def render_batch_progress():
+    """轻量自动刷新片段：只轮询任务状态，其余界面可继续操作"""
+    jobs = get_job_store().get_jobs(f["id"] for f in st.session_state.batch_files).values()
+    finished = sum(1 for j in jobs if j["status"] in (FileStatus.COMPLETED.value, FileStatus.FAILED.value))
+    running = sum(1 for j in jobs if j["status"] == FileStatus.PROCESSING.value)
+    active = finished < len(jobs)
+    if active:
+        st.progress(finished / len(jobs), text=f"🚀 后台处理中: {finished}/{len(jobs)} 完成，{running} 个运行中")
+        stats = get_batch_runner().stats(get_batch_run_id())
+        if stats["own_running"] or stats["own_queued"]:
+            st.caption(
+                f"🌐 全局: {stats['running']}/{stats['capacity']} 个槽位占用，{stats['sessions']} 个会话共享，"
+                f"共 {stats['queued']} 个排队（本会话 {stats['own_queued']} 个）"
+            )
     
-    # 自动跳转到“已完成”标签
-    st.session_state.batch_processing = False
-    st.session_state.batch_active_tab = "✅ 已完成" 
-    st.rerun()
+    # 有文件状态变化时刷新整页列表；批次结束后跳转到“已完成”
+    if sync_batch_run():
+        if not active:
+            st.session_state.batch_jump_tab = "✅ 已完成"
+        st.rerun()
 
 # =========================================================
 # ⭐ 修改：UI 渲染 (改用 Radio 实现可控标签页，紧凑布局)
 # =========================================================
-def render_batch_processing_ui():
+def render_batch_processing_ui(api_key_doc2x, api_key_mineru, force_ocr, math_mode, batch_settings=DEFAULT_BATCH_SETTINGS):
     st.header("📦 批量文档处理")
     manager = BatchFileManager()
     
-    # 初始化标签页状态
+    # 初始化标签页状态（跳转请求需在 radio 创建前应用）
     if "batch_active_tab" not in st.session_state:
         st.session_state.batch_active_tab = "⏳ 待处理"
+    if "batch_jump_tab" in st.session_state:
+        st.session_state.batch_active_tab = st.session_state.pop("batch_jump_tab")
 
     # 上传区域
     with st.expander("📤 上传文件", expanded=len(st.session_state.batch_files) == 0):
+        # 添加后更换上传控件的 key，释放控件里缓存的文件内容
+        uploader_gen = st.session_state.get("batch_uploader_gen", 0)
         uploaded_files = st.file_uploader(
-            "选择 PDF 文件（可多选）", type=["pdf"], accept_multiple_files=True, key="batch_uploader"
+            "选择 PDF 文件（可多选）", type=["pdf"], accept_multiple_files=True, key=f"batch_uploader_{uploader_gen}"
         )
         if uploaded_files and st.button("➕ 添加到处理列表"):
-            manager.add_files(uploaded_files)
-            st.success(f"已添加 {len(uploaded_files)} 个文件")
+            skipped = manager.add_files(uploaded_files)
+            st.session_state.batch_uploader_gen = uploader_gen + 1
+            st.success(f"已添加 {len(uploaded_files) - len(skipped)} 个文件")
+            if skipped: st.toast(f"{len(skipped)} 个文件与列表中已有文件内容相同，已跳过: {', '.join(skipped)}", icon="♊")
+            st.rerun()
+    
+    # 任务日志中有未完成、不在当前列表里、且本进程也没有在运行的任务（服务重启前提交）；
+    # 其他浏览器会话的任务、以及本会话“清空”后仍在运行的任务都还在调度器里，不算中断
+    known_ids = {f["id"] for f in st.session_state.batch_files}
+    active_ids = get_batch_runner().active_job_ids()
+    orphan_jobs = [j for j in get_job_store().unfinished_jobs() if j["id"] not in known_ids and j["id"] not in active_ids]
+    if orphan_jobs:
+        c_info, c_resume, c_drop = st.columns([4, 1, 1])
+        c_info.warning(f"♻️ 发现 {len(orphan_jobs)} 个未完成的任务，可从上次完成的阶段继续（不会重新上传、重新解析）")
+        if c_resume.button("♻️ 继续", use_container_width=True):
+            resume_batch_jobs(orphan_jobs, api_key_doc2x, api_key_mineru, batch_settings)
+            st.rerun()
+        if c_drop.button("🗑️ 丢弃", use_container_width=True):
+            get_job_store().delete_jobs(j["id"] for j in orphan_jobs)
             st.rerun()
     
     if not st.session_state.batch_files:
@@ -592,7 +346,7 @@ def render_batch_processing_ui():
         c1, c2, c3 = st.columns(3)
         if pending > 0:
             if c1.button("🚀 开始", type="primary", use_container_width=True):
-                st.session_state.batch_processing = True
+                process_batch_files(api_key_doc2x, api_key_mineru, force_ocr, math_mode, batch_settings)
                 st.rerun()
         if completed > 0:
             if c2.button("🧹 清除", help="清除已完成任务", use_container_width=True):
@@ -600,7 +354,19 @@ def render_batch_processing_ui():
                 st.rerun()
         if c3.button("🗑️ 清空", help="清空所有任务", use_container_width=True):
             st.session_state.batch_files = []
+            get_batch_runner().forget(get_batch_run_id())
             st.rerun()
+    
+    # 独立 worker 模式下提示在线 worker 数量
+    if batch_settings["executor"] == EXECUTOR_WORKER:
+        live_workers = get_job_store().live_workers()
+        if live_workers:
+            st.caption(f"🖥️ 在线 Worker: {len(live_workers)} 个（总并发 {sum(w['concurrency'] for w in live_workers)}）")
+        else:
+            st.warning("⚠️ 当前没有在线的 Worker，任务会在队列中等待。请运行 `python pdf_worker.py` 启动 worker。")
+    
+    # 后台批次进度（自动刷新片段）
+    render_batch_progress()
             
     st.divider()
     
@@ -620,7 +386,7 @@ def render_batch_processing_ui():
     
     # 根据选择渲染列表
     if selected_tab == "⏳ 待处理":
-        render_file_list(manager.get_files_by_status(FileStatus.PENDING.value), manager)
+        render_file_list(manager.get_files_by_status(FileStatus.PENDING.value), manager, edit_range=True)
     elif selected_tab == "⚙️ 处理中":
         render_file_list(manager.get_files_by_status(FileStatus.PROCESSING.value), manager)
     elif selected_tab == "✅ 已完成":
@@ -628,8 +394,8 @@ def render_batch_processing_ui():
     elif selected_tab == "❌ 失败":
         render_file_list(manager.get_files_by_status(FileStatus.FAILED.value), manager, show_error=True)
 
-def render_file_list(files, manager, show_download=False, show_error=False):
-    """渲染文件列表（紧凑版）"""
+def render_file_list(files, manager, show_download=False, show_error=False, edit_range=False):
+    """渲染文件列表（紧凑版）；edit_range 为 True 时每个文件可填写页码范围"""
     if not files:
         st.info("此分类下暂无文件")
         return
@@ -648,6 +414,16 @@ def render_file_list(files, manager, show_download=False, show_error=False):
             with c1:
                 st.markdown(f"**{file['name']}**")
                 st.caption(f"{file['size'] / 1024:.1f} KB")
+                if edit_range and PYPDF_AVAILABLE:
+                    # file 是 session_state 中的同一个字典，直接写回
+                    file["page_range"] = st.text_input(
+                        "页码范围", value=file.get("page_range") or "", key=f"range_{file['id']}",
+                        placeholder="全部页（如 1-20, 35）", label_visibility="collapsed"
+                    )
+                elif file.get("page_range"):
+                    st.caption(f"页码 {file['page_range']}")
+                if file.get("saved_bytes"):
+                    st.caption(f"🗜️ 瘦身节省 {file['saved_bytes'] / 1024:.1f} KB")
             
             with c2: 
                 st.write(f"{file['status']}")
@@ -696,18 +472,132 @@ def render_file_list(files, manager, show_download=False, show_error=False):
 def load_file_to_single_mode(file_info):
     result_dir = Path(file_info['result_path'])
     md_path = FormatConverter.get_md_file_path(result_dir)
-    pdf_files = list(Path("./temp_uploads").glob(file_info['name']))
+    pdf_files = [Path(file_info['pdf_path'])] if file_info.get('pdf_path') else []
+    pdf_files = [p for p in pdf_files if p.exists()]
     if not md_path or not pdf_files:
         st.error("文件缺失，无法编辑")
         return
     
     with open(md_path, "r", encoding="utf-8") as f: content = f.read()
-    st.session_state.work_paths = {"pdf": str(pdf_files[0]), "md": str(md_path.resolve()), "dir": str(result_dir.resolve())}
+    # 落盘文件按内容哈希命名，原文件名单独记录，导出时沿用
+    st.session_state.work_paths = {
+        "pdf": str(pdf_files[0]), "name": file_info['name'],
+        "md": str(md_path.resolve()), "dir": str(result_dir.resolve())
+    }
     st.session_state.current_md_content = content
     st.session_state.work_mode = "single"
     st.session_state.step = "editing"
     st.session_state.from_batch_file_id = file_info['id']
 
+def render_page_reparse(paths, api_key_doc2x, api_key_mineru, use_cache=True):
+    """编辑步骤：重新解析指定页，预览后替换 Markdown 中对应的片段（不重跑整本）"""
+    pdf_path = Path(paths.get("pdf") or "")
+    candidate = st.session_state.get("reparse_candidate")
+    with st.expander("🔁 重新解析指定页", expanded=bool(candidate)):
+        if not PYPDF_AVAILABLE or not pdf_path.is_file():
+            st.caption("需要 pypdf 以及磁盘上的 PDF 原件（开启对照预览或从批量列表进入时可用）")
+            return
+        
+        if candidate:
+            content = st.session_state.current_md_content
+            # 生成候选后又手动改过内容时，按当前内容重新定位
+            if content[candidate["start"]:candidate["end"]] != candidate["old"]:
+                candidate["start"], candidate["end"], candidate["exact"] = locate_page_region(
+                    content, pdf_path, candidate["first"], candidate["last"]
+                )
+                candidate["old"] = content[candidate["start"]:candidate["end"]]
+            if not candidate["exact"]:
+                st.warning("没能按文字层定位（可能是扫描件），替换位置按页数比例估算，请核对下方内容")
+            c1, c2 = st.columns(2)
+            c1.caption(f"将被替换的内容（第 {candidate['first']}-{candidate['last']} 页，{len(candidate['old'])} 字符）")
+            c1.code(candidate["old"][:3000] or "（空）", language="markdown")
+            c2.caption("重新解析的结果")
+            c2.code(candidate["preview"][:3000] or "（空）", language="markdown")
+            
+            b1, b2 = st.columns(2)
+            applied = b1.button("✅ 应用替换", type="primary", use_container_width=True)
+            if applied:
+                new_content = splice_markdown(
+                    content, candidate["start"], candidate["end"], candidate["part_dir"], Path(paths["md"]).parent
+                )
+                st.session_state.current_md_content = new_content
+                # 编辑器尚未渲染，直接同步它的内容
+                st.session_state.editor_textarea = new_content
+                total_words, chinese_chars, english_words = DocumentStats.count_markdown_words(new_content)
+                st.session_state.doc_stats.update(
+                    total_words=total_words, chinese_chars=chinese_chars, english_words=english_words
+                )
+            if applied or b2.button("取消", use_container_width=True):
+                shutil.rmtree(candidate["part_dir"], ignore_errors=True)
+                del st.session_state.reparse_candidate
+                st.rerun()
+            return
+        
+        pages = st.session_state.doc_stats.get("pdf_pages") or DocumentStats.count_pdf_pages(pdf_path) or 1
+        with st.form("reparse_pages_form", border=False):
+            c1, c2, c3 = st.columns([1, 1, 1.2])
+            first = c1.number_input("起始页", 1, pages, 1)
+            last = c2.number_input("结束页", 1, pages, 1)
+            reparse_ocr = c3.checkbox("🔍 强制 OCR", value=True, help="乱码多为文字层损坏，OCR 重新识别通常更可靠")
+            submitted = st.form_submit_button("重新解析这些页")
+        if not submitted: return
+        if last < first:
+            st.error("结束页不能小于起始页")
+            return
+        engine = select_engine(api_key_doc2x, api_key_mineru)
+        if not engine:
+            st.error("请先在左侧填写 API Key（标准 或 期刊增强）")
+            return
+        try:
+            with get_batch_runner().slot(get_batch_run_id()):
+                part_dir = reparse_pages(
+                    engine, api_key_mineru if engine == "mineru" else api_key_doc2x, pdf_path,
+                    int(first), int(last), reparse_ocr, use_cache=use_cache
+                )
+            md_path = FormatConverter.get_md_file_path(part_dir)
+            content = st.session_state.current_md_content
+            start, end, exact = locate_page_region(content, pdf_path, int(first), int(last))
+            st.session_state.reparse_candidate = {
+                "first": int(first), "last": int(last), "start": start, "end": end, "exact": exact,
+                "old": content[start:end], "part_dir": str(part_dir),
+                "preview": md_path.read_text(encoding="utf-8") if md_path else "",
+            }
+            st.rerun()
+        except Exception as e:
+            st.error(f"重新解析失败: {str(e)}")
+
+def render_rate_limit_settings(api_key_doc2x="", api_key_mineru=""):
+    """侧边栏：各引擎接口限流（进程级，修改后对所有会话生效）及 Key 池状态"""
+    def apply(engine):
+        configure_engine_limits(
+            engine, st.session_state[f"rps_{engine}"], st.session_state[f"inflight_{engine}"]
+        )
+    
+    with st.expander("🚦 接口限流（全局）"):
+        for engine, label in (("doc2x", "标准引擎"), ("mineru", "期刊增强")):
+            limits = ENGINE_LIMITS[engine]
+            st.number_input(
+                f"{label} 每秒请求数", 0.1, 100.0, float(limits["rate"]), step=0.5,
+                key=f"rps_{engine}", on_change=apply, args=(engine,)
+            )
+            st.number_input(
+                f"{label} 同时解析数", 1, 100, int(limits["max_inflight"]),
+                key=f"inflight_{engine}", on_change=apply, args=(engine,),
+                help="同一 API Key 同时在服务商处解析的文档数上限，超出的在本地排队"
+            )
+            # 多 Key 时显示各 Key 的负载与今日用量（只显示指纹）
+            pool = KeyPool(engine, api_key_mineru if engine == "mineru" else api_key_doc2x)
+            if len(pool.keys) > 1:
+                for row in pool.status():
+                    state = "⛔ 额度用完" if row["exhausted"] else ("⏸️ 限流中" if row["throttled"] else "✅ 可用")
+                    quota = f"/{row['quota']}" if row["quota"] else ""
+                    st.caption(f"`{row['key']}` {state} · 进行中 {row['active']} · 今日 {row['used_pages']:.0f}{quota} 页")
+        st.number_input(
+            "HTTP 连接池大小（每主机）", 1, 256, int(HTTP_POOL["maxsize"]), key="http_pool_maxsize",
+            on_change=lambda: configure_http_pool(maxsize=st.session_state.http_pool_maxsize),
+            help="每个服务商主机保留的 keep-alive 连接数，建议不小于所有 Key 同时解析数之和"
+        )
+
 # =========================================================
 # 5. Main 主程序
 # =========================================================
@@ -716,25 +606,78 @@ def main():
     st.title("🛠️ 夷卓汇文档工作台")
 
     # 初始化状态
+    if "batch_files" not in st.session_state: restore_batch_run()
     if "step" not in st.session_state: st.session_state.step = "upload"
     if "current_md_content" not in st.session_state: st.session_state.current_md_content = ""
     if "work_paths" not in st.session_state: st.session_state.work_paths = {}
     if "doc_stats" not in st.session_state: st.session_state.doc_stats = {}
-    if "batch_processing" not in st.session_state: st.session_state.batch_processing = False
     if "work_mode" not in st.session_state: st.session_state.work_mode = "single"
     if "batch_files" not in st.session_state: st.session_state.batch_files = []
 
     # 侧边栏
     with st.sidebar:
         st.header("⚙️ 设置")
-        api_key_doc2x = st.text_input("API Key (标准引擎)", type="password")
-        api_key_mineru = st.text_input("API Key (期刊增强)", type="password")
-        force_ocr = st.checkbox("🔍 强制 OCR", value=False)
+        api_key_doc2x = st.text_input("API Key (标准引擎)", type="password", help="可填多个 Key，用逗号分隔，任务会在多个账号间分摊")
+        api_key_mineru = st.text_input("API Key (期刊增强)", type="password", help="可填多个 Key，用逗号分隔，任务会在多个账号间分摊")
+        ocr_mode = st.radio(
+            "🔍 OCR", ["auto", "on", "off"], horizontal=True,
+            format_func={"auto": "自动判断", "on": "强制 OCR", "off": "不强制"}.get,
+            help="自动判断：解析前抽样几页检查文字层，扫描件或文字层损坏的文件启用 OCR，其余不启用（每个文件单独判断）"
+        )
+        # None 表示由每个文件的文字层抽样决定
+        force_ocr = {"auto": None, "on": True, "off": False}[ocr_mode]
+        use_cache = st.checkbox(
+            "♻️ 复用解析缓存", value=True,
+            help="同一份 PDF 用相同引擎和选项解析过时直接使用上次的结果；取消勾选则强制重新解析并更新缓存"
+        )
+        split_large = st.checkbox(
+            "✂️ 大文件分块并行解析", value=False, disabled=not PYPDF_AVAILABLE,
+            help=f"超过 {SPLIT_THRESHOLD_PAGES} 页的 PDF 每 {CHUNK_PAGES} 页切成一块同时解析，再拼回一个文档（需要 pypdf）"
+        )
+        local_mode = st.radio(
+            "💻 本地快速提取", [LOCAL_OFF, LOCAL_AUTO, LOCAL_ALWAYS],
+            format_func={LOCAL_OFF: "关闭", LOCAL_AUTO: "自动（简单文字型 PDF）", LOCAL_ALWAYS: "全部本地"}.get,
+            help="直接读取 PDF 文字层，一秒内完成、不消耗额度，但不识别公式、表格和图片；"
+                 "自动：文字层完整且没有公式的文件走本地，其余仍走云端引擎"
+        )
+        slim_upload = st.checkbox(
+            "🗜️ 上传前瘦身 PDF", value=False, disabled=not PYPDF_AVAILABLE,
+            help="无损处理：合并重复对象、去掉缩略图和未使用的资源、压缩未压缩的数据流，页面内容不变；适合上行带宽慢时的大扫描件"
+        )
+        batch_workers = st.slider(
+            "⚡ 批量并发数", 1, MAX_BATCH_WORKERS, DEFAULT_BATCH_WORKERS,
+            help=f"本会话最多同时处理的文件数；全服务器共享 {GLOBAL_MAX_WORKERS} 个槽位，按会话轮流分配"
+        )
+        batch_executor = st.radio(
+            "批量执行方式", [EXECUTOR_LOCAL, EXECUTOR_WORKER],
+            format_func=lambda x: "本机后台" if x == EXECUTOR_LOCAL else "独立 Worker 队列",
+            help="独立 Worker 队列：界面只负责入队和展示，由 pdf_worker.py 进程执行解析与转换"
+        )
+        batch_policy = st.radio(
+            "批量调度顺序", [POLICY_FIFO, POLICY_SJF],
+            format_func=lambda x: "按上传顺序" if x == POLICY_FIFO else "短作业优先（按页数）",
+            help="短作业优先：页数少的文件先处理，等待越久优先级越高，大文件不会一直排在后面"
+        )
+        batch_hedge = st.checkbox(
+            "🔀 双引擎对冲", value=False, disabled=not (api_key_doc2x and api_key_mineru),
+            help=f"两个引擎都填了 Key 时可用：批量任务提交 {HEDGE_AFTER_SECONDS:.0f} 秒后主引擎仍未开始解析，"
+                 "就同时提交给另一个引擎，取先完成的结果（会额外消耗另一引擎的额度）"
+        )
+        batch_settings = {
+            "workers": batch_workers, "executor": batch_executor, "policy": batch_policy,
+            "hedge": batch_hedge and bool(api_key_doc2x and api_key_mineru),
+            "use_cache": use_cache,
+            "split": split_large,
+            "slim": slim_upload,
+            "local_mode": local_mode,
+        }
+        render_rate_limit_settings(api_key_doc2x, api_key_mineru)
         math_mode = st.radio("数学公式", ["mathml", "webtex", "mathjax"])
         st.session_state.math_mode = math_mode
         st.divider()
         if st.button("🔄 重置"):
             st.session_state.clear()
+            st.query_params.clear()
             st.rerun()
         # 👇👇👇 新增：格式转换工具箱 👇👇👇
         st.markdown("### 🛠️ 格式工具箱")
@@ -767,10 +710,7 @@ def main():
 
     # 📌 修改：路由逻辑
     if st.session_state.work_mode == "batch":
-        if st.session_state.batch_processing:
-            process_batch_files(api_key_doc2x, api_key_mineru, force_ocr, math_mode)
-        else:
-            render_batch_processing_ui()
+        render_batch_processing_ui(api_key_doc2x, api_key_mineru, force_ocr, math_mode, batch_settings)
 
     elif st.session_state.work_mode == "converter":
         # 获取具体的子模式，默认为 to_epub
@@ -784,33 +724,65 @@ def main():
         if st.session_state.step == "upload":
             st.info("步骤 1/3: 上传 PDF 进行智能解析")
             uploaded_file = st.file_uploader("选择 PDF 文件", type=["pdf"])
+            page_range = st.text_input(
+                "页码范围（可选）", placeholder="如 1-20, 35, 40-；留空解析全部页", disabled=not PYPDF_AVAILABLE,
+                help="只上传和解析所选页，耗时和额度按所选页数计算（需要 pypdf）"
+            )
 
             if uploaded_file and st.button("🚀 开始解析"):
-                # 获取左侧栏选择的引擎
-                if api_key_mineru:
-                    selected_engine = "mineru"
-                elif api_key_doc2x:
-                    selected_engine = "doc2x"
-                else:
-                    st.error("请先在左侧填写 API Key（标准 或 期刊增强）")
-                    return
-                
                 try:
-                    temp_dir = Path("./temp_uploads")
-                    temp_dir.mkdir(exist_ok=True)
-                    pdf_path = (temp_dir / uploaded_file.name).resolve()
-                    with open(pdf_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-
-                    pdf_pages = DocumentStats.count_pdf_pages(pdf_path)
-
-                    # 执行解析 (注意：单文件模式下 silent=False，显示进度条)
-                    if selected_engine == "mineru":
-                        client = MinerUOnlineClient(api_key_mineru)
-                        output_dir = client.process(pdf_path, force_ocr, silent=False)
+                    # 直接从上传缓冲区读取并上传，不先复制到 temp_uploads
+                    source = PdfSource.from_upload(uploaded_file)
+                    if page_range.strip(): source = trim_pdf(source, page_range)
+                    # 获取左侧栏选择的引擎（自动本地提取与自动 OCR 共用一次文字层抽样）
+                    probe = DocumentStats.probe_text_layer(source) if local_mode == LOCAL_AUTO else None
+                    selected_engine = select_engine(api_key_doc2x, api_key_mineru, source, local_mode, probe)
+                    if not selected_engine:
+                        st.error("请先在左侧填写 API Key（标准 或 期刊增强）")
+                        return
+                    # 本地提取不需要瘦身、解析缓存和解析槽位；OCR 开关只有 MinerU 有
+                    is_local = selected_engine == "local"
+                    if force_ocr is None and selected_engine == "mineru":
+                        force_ocr = resolve_force_ocr(None, source, probe)
+                        st.toast("文字层不完整，已自动启用 OCR" if force_ocr else "文字层完整，不启用 OCR", icon="🔍")
+                    if slim_upload and not is_local:
+                        source, saved_bytes = slim_pdf(source)
+                        if saved_bytes:
+                            st.toast(f"上传前瘦身节省 {saved_bytes / 1024 / 1024:.2f} MB", icon="🗜️")
+                    pdf_pages = DocumentStats.count_pdf_pages(source)
+
+                    if is_local:
+                        output_dir = LocalTextClient().process(source)
+                        st.toast("已用本地文字层提取完成解析", icon="💻")
                     else:
-                        client = Doc2XPDFClient(api_key_doc2x)
-                        output_dir = client.process(pdf_path, silent=False)
+                        # 解析过的文件直接取缓存，不占用解析槽位
+                        output_dir = restore_cached_parse(selected_engine, source, force_ocr) if use_cache else None
+                        if output_dir:
+                            st.toast("命中解析缓存，已直接使用上次的解析结果", icon="♻️")
+                        else:
+                            # 执行解析 (注意：单文件模式下 silent=False，显示进度条)
+                            # 与所有会话的批量任务共用全局槽位，服务器繁忙时在此排队
+                            runner = get_batch_runner()
+                            if runner.stats()["running"] >= runner.max_concurrency:
+                                st.toast("服务器繁忙，正在排队等待解析槽位...", icon="⏳")
+                            with runner.slot(get_batch_run_id()):
+                                api_keys = api_key_mineru if selected_engine == "mineru" else api_key_doc2x
+                                if split_large and should_split(pdf_pages):
+                                    chunk_bar = st.progress(0, text=f"共 {pdf_pages} 页，分块并行解析中...")
+                                    output_dir = chunked_parse(
+                                        selected_engine, api_keys, source, force_ocr, use_cache=use_cache,
+                                        on_progress=lambda done, total: chunk_bar.progress(
+                                            done / total, text=f"分块并行解析中：已完成 {done}/{total} 块"
+                                        )
+                                    )
+                                else:
+                                    output_dir = parse_with_key_pool(
+                                        selected_engine, api_keys, source, force_ocr, silent=False, cost=pdf_pages,
+                                        use_cache=use_cache
+                                    )
+                    
+                    # 只有对照预览需要磁盘上的 PDF：解析完成后写入结果目录
+                    pdf_path = source.save(output_dir) if DocComparator else Path(uploaded_file.name)
                     
                     # 获取并重命名 Markdown 文件 (保持文件名一致性)
                     md_path = FormatConverter.get_md_file_path(output_dir)
@@ -832,7 +804,7 @@ def main():
 
                     # 更新 Session State
                     st.session_state.work_paths = {
-                        "pdf": str(pdf_path),
+                        "pdf": str(pdf_path.resolve()),
                         "md": str(md_path.resolve()),
                         "dir": str(output_dir.resolve())
                     }
@@ -882,6 +854,8 @@ def main():
                     st.session_state.step = "generating"
                     st.rerun()
 
+            render_page_reparse(paths, api_key_doc2x, api_key_mineru, use_cache)
+
             # 编辑器渲染
             if DocComparator:
                 cmp = DocComparator()
@@ -905,7 +879,7 @@ def main():
             paths = st.session_state.work_paths
             md_path = Path(paths["md"])
             output_dir = Path(paths["dir"])
-            pdf_path = Path(paths["pdf"])
+            pdf_path = Path(paths.get("name") or paths["pdf"])
             original_stem = pdf_path.stem # 使用原文件名
             
             st.write("1. 保存最终内容...")
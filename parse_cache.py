@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+
+# =========================================================
+# 解析结果缓存
+# =========================================================
+# 以 (PDF 内容 SHA-256, 引擎, 解析选项) 为键，保存解压后的 Markdown 结果包（Markdown + 图片）。
+# 同一份 PDF 用相同引擎和选项再次解析时直接复制缓存，不再走 上传 → 解析 → 导出 → 下载。
+# 缓存放在磁盘上，服务重启后仍然有效；多个进程（界面 / worker）可以共用同一目录：
+# 写入先放到临时目录再整体改名，读取失败按未命中处理。
+# 超过容量上限时按最近使用时间淘汰最旧的条目。
+
+PARSE_CACHE_DIR = Path(os.environ.get("PDF_PARSE_CACHE_DIR", "./parse_cache"))
+# 容量上限（MB），设为 0 关闭缓存
+PARSE_CACHE_MAX_MB = float(os.environ.get("PDF_PARSE_CACHE_MB", 2048))
+
+META_FILE = "cache.json"
+
+
+def _dir_size(path):
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file())
+
+
+class ParseCache:
+    def __init__(self, cache_dir=PARSE_CACHE_DIR, max_bytes=PARSE_CACHE_MAX_MB * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def cache_key(self, pdf_sha256, engine, options=None):
+        raw = json.dumps([pdf_sha256, engine, options or {}], sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+    def restore(self, pdf_sha256, engine, options, target_dir):
+        """命中时把结果包复制到 target_dir（已存在则清空）并返回该目录，未命中返回 None"""
+        if not self.enabled: return None
+        entry = self.cache_dir / self.cache_key(pdf_sha256, engine, options)
+        if not (entry / META_FILE).exists(): return None
+        target_dir = Path(target_dir)
+        try:
+            if target_dir.exists(): shutil.rmtree(target_dir)
+            shutil.copytree(entry, target_dir, ignore=shutil.ignore_patterns(META_FILE))
+            os.utime(entry / META_FILE)  # 记录最近使用时间，供淘汰排序
+        except OSError:
+            # 复制途中被其他进程淘汰等情况，按未命中处理
+            shutil.rmtree(target_dir, ignore_errors=True)
+            return None
+        return target_dir
+
+    def put(self, pdf_sha256, engine, options, bundle_dir, replace=False):
+        """保存一份解析结果（只复制结果包，不影响 bundle_dir 本身）
+
+        条目已存在时默认保留旧条目；replace 为 True（绕过缓存重新解析后）用新结果覆盖。
+        """
+        if not self.enabled: return
+        key = self.cache_key(pdf_sha256, engine, options)
+        entry = self.cache_dir / key
+        if (entry / META_FILE).exists() and not replace: return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        temp_dir = self.cache_dir / f".tmp-{uuid.uuid4().hex}"
+        try:
+            shutil.copytree(bundle_dir, temp_dir)
+            meta = {
+                "sha256": pdf_sha256, "engine": engine, "options": options or {},
+                "size": _dir_size(temp_dir), "created": time.time(),
+            }
+            with open(temp_dir / META_FILE, "w", encoding="utf-8") as f: json.dump(meta, f)
+            if replace and entry.exists(): shutil.rmtree(entry)
+            temp_dir.rename(entry)
+        except OSError:
+            # 其他进程同时写入了同一条目
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return
+        self.evict()
+
+    def entries(self):
+        """[(条目目录, 大小, 最近使用时间)]"""
+        rows = []
+        if not self.cache_dir.exists(): return rows
+        for entry in self.cache_dir.iterdir():
+            meta_path = entry / META_FILE
+            try:
+                with open(meta_path, encoding="utf-8") as f: size = json.load(f)["size"]
+                rows.append((entry, size, meta_path.stat().st_mtime))
+            except (OSError, ValueError, KeyError):
+                continue
+        return rows
+
+    def evict(self):
+        """超出容量上限时删除最久未使用的条目"""
+        with self._lock:
+            rows = sorted(self.entries(), key=lambda row: row[2])
+            total = sum(size for _, size, _ in rows)
+            for entry, size, _ in rows:
+                if total <= self.max_bytes: break
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+
+    def stats(self):
+        rows = self.entries()
+        return {"entries": len(rows), "bytes": sum(size for _, size, _ in rows), "max_bytes": self.max_bytes}
+
+    def clear(self):
+        with self._lock:
+            for entry, _, _ in self.entries():
+                shutil.rmtree(entry, ignore_errors=True)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_parse_cache():
+    """进程级共享的解析缓存"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ParseCache()
+        return _cache
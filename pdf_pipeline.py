@@ -0,0 +1,1583 @@
+import streamlit as st
+import io
+import hashlib
+import uuid
+import zipfile
+import shutil
+import subprocess
+import re
+import os
+import secrets
+import posixpath
+import threading
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from pathlib import Path
+from urllib.parse import unquote
+
+from api_guard import (
+    get_limiter, get_breaker, get_session, guarded_request, is_quota_error, key_fingerprint,
+    Deadline, JOB_TIMEOUT_SECONDS, STAGE_TIMEOUTS, JobCancelledError, KeyPool, QuotaExceededError,
+)
+from status_poller import get_status_poller, wait_for, AdaptiveInterval
+from callback_receiver import get_callback_receiver
+from parse_cache import get_parse_cache
+from batch_runner import JOB_RUNNING, JOB_DONE, JOB_FAILED
+from job_store import (
+    stage_reached, STAGE_PARSE_SUBMITTED, STAGE_PARSE_DONE,
+    STAGE_EXPORTED, STAGE_DOWNLOADED, STAGE_CONVERTED,
+)
+
+# =========================================================
+# 解析与转换流水线
+# =========================================================
+# 解析客户端、格式转换和单文件任务都不依赖会话状态：
+# Streamlit 界面 (main-two.py) 和独立 worker 进程 (pdf_worker.py) 共用这一份实现。
+
+# 尝试导入 PyPDF
+try:
+    import pypdf
+    from pypdf.generic import DictionaryObject, NameObject
+    PYPDF_AVAILABLE = True
+except ImportError:
+    PYPDF_AVAILABLE = False
+
+# =========================================================
+# 待解析的 PDF
+# =========================================================
+class _BufferReader(io.RawIOBase):
+    """只读、可 seek 的内存缓冲区视图，读取时不复制整个缓冲区"""
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast("B")
+        self._pos = 0
+
+    def readable(self): return True
+
+    def seekable(self): return True
+
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self): return self._pos
+
+
+class PdfSource:
+    """磁盘上的 PDF，或内存中的上传缓冲区（如 Streamlit UploadedFile）
+
+    解析客户端通过 open() 读取内容上传，缓冲区来源无需先写入 temp_uploads；
+    需要磁盘文件的后续步骤（对照预览等）再调用 save() 落盘。
+    """
+    def __init__(self, name, path=None, buffer=None):
+        self.name = name
+        self.path = Path(path) if path else None
+        self.buffer = buffer
+        self._sha256 = None
+
+    @classmethod
+    def from_upload(cls, uploaded_file):
+        return cls(uploaded_file.name, buffer=uploaded_file.getbuffer())
+
+    @property
+    def stem(self):
+        return Path(self.name).stem
+
+    @property
+    def size(self):
+        return self.path.stat().st_size if self.path else len(self.buffer)
+
+    def open(self):
+        if self.path: return open(self.path, "rb")
+        return io.BufferedReader(_BufferReader(self.buffer))
+
+    def sha256(self):
+        """内容的 SHA-256（计算一次后记住）"""
+        if self._sha256 is None:
+            digest = hashlib.sha256()
+            with self.open() as f:
+                for chunk in iter(lambda: f.read(SPOOL_CHUNK_SIZE), b""): digest.update(chunk)
+            self._sha256 = digest.hexdigest()
+        return self._sha256
+
+    def save(self, directory):
+        """写入 directory/<文件名> 并返回路径（本身就是磁盘文件时直接返回）"""
+        if self.path: return self.path
+        path = Path(directory) / self.name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f: f.write(self.buffer)
+        return path
+
+
+def as_pdf_source(pdf):
+    """路径或 PdfSource -> PdfSource"""
+    return pdf if isinstance(pdf, PdfSource) else PdfSource(Path(pdf).name, path=pdf)
+
+
+# 页码范围：只解析需要的章节。Doc2X 接口没有页码参数，MinerU 的 page_ranges 仍要上传整本，
+# 因此统一在上传前用 pypdf 裁剪——上传量、解析耗时和额度都只与所选页数相关，解析缓存也按裁剪后的内容命中。
+def parse_page_ranges(text, total=None):
+    """"1-20, 35, 40-" -> 升序去重的页号列表（从 1 开始）；格式错误或超出总页数时抛 ValueError"""
+    pages = set()
+    for part in re.split(r'[,，;；]', text or ""):
+        part = part.strip()
+        if not part: continue
+        m = re.fullmatch(r'(\d*)\s*[-~～–]\s*(\d*)|(\d+)', part)
+        if not m: raise ValueError(f"无法识别的页码: {part}")
+        if m.group(3):
+            start = end = int(m.group(3))
+        else:
+            if not m.group(2) and total is None: raise ValueError(f"总页数未知，无法展开: {part}")
+            start, end = int(m.group(1) or 1), int(m.group(2) or total)
+        if start < 1 or end < start: raise ValueError(f"页码范围无效: {part}")
+        if total and end > total: raise ValueError(f"页码超出总页数 {total}: {part}")
+        pages.update(range(start, end + 1))
+    return sorted(pages)
+
+def _write_derived(source, writer, suffix):
+    """写出由 source 生成的 PDF，返回文件名不变的 PdfSource
+
+    磁盘上的来源（批量任务的落盘文件）写到同目录的 <原文件名>.<suffix>.pdf（先写临时文件再改名），
+    不在内存中保留整份副本；内存来源（单文件上传）的结果留在内存，直接引用写出的缓冲区，不再复制。
+    """
+    if source.path:
+        path = source.path.with_name(f"{source.path.stem}.{suffix}.pdf")
+        temp_path = path.with_name(f".{uuid.uuid4().hex}.part")
+        try:
+            with open(temp_path, "wb") as f: writer.write(f)
+            temp_path.replace(path)
+        finally:
+            if temp_path.exists(): temp_path.unlink()
+        return PdfSource(source.name, path=path)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return PdfSource(source.name, buffer=buffer.getbuffer())
+
+def trim_pdf(pdf, page_range):
+    """只保留 page_range 中的页，返回 PdfSource（文件名不变，结果目录与整本解析相同）；选中全部页时原样返回"""
+    if not PYPDF_AVAILABLE: raise Exception("未安装 pypdf，无法按页码范围解析")
+    source = as_pdf_source(pdf)
+    with source.open() as f:
+        reader = pypdf.PdfReader(f)
+        pages = parse_page_ranges(page_range, len(reader.pages))
+        if not pages: raise ValueError("页码范围为空")
+        if len(pages) == len(reader.pages): return source
+        writer = pypdf.PdfWriter()
+        for number in pages: writer.add_page(reader.pages[number - 1])
+        # 同一文件、同一页码范围的裁剪结果写到同一个文件
+        digest = hashlib.sha256(",".join(map(str, pages)).encode("ascii")).hexdigest()[:12]
+        return _write_derived(source, writer, f"pages-{digest}")
+
+
+# 上传前瘦身：只做无损处理，页面显示内容不变——
+#   - 去掉页面缩略图 (/Thumb)；
+#   - 内容流里没有用到的字体、图片 / 表单 (XObject)、图形状态从该页资源中移除（共享的资源字典先复制再改）；
+#     没有自带 /Resources 的表单和 Type3 字体沿用页面资源，它们内容里用到的名称同样保留；
+#   - 合并内容完全相同的对象，丢弃不再被引用的对象；
+#   - 未压缩的页面内容流用 Flate 压缩。
+# 图片不重新编码。处理失败或没有变小时原样上传。
+SLIM_RESOURCE_TYPES = ("/XObject", "/Font", "/ExtGState")
+SIMPLE_NAME_PATTERN = re.compile(r'^/[A-Za-z0-9_.\-]+$')
+
+def _resource_names(data):
+    return set(re.findall(rb'/([A-Za-z0-9_.\-]+)', data))
+
+def _inherited_streams(resources, name):
+    """名称 name 指向的、没有自带 /Resources（因而沿用页面资源）的表单或 Type3 字形流"""
+    streams = []
+    xobjects = resources.get("/XObject")
+    if xobjects is not None and name in xobjects.get_object():
+        xobject = xobjects.get_object()[name].get_object()
+        if xobject.get("/Subtype") == "/Form" and "/Resources" not in xobject: streams.append(xobject)
+    fonts = resources.get("/Font")
+    if fonts is not None and name in fonts.get_object():
+        font = fonts.get_object()[name].get_object()
+        if font.get("/Subtype") == "/Type3" and "/Resources" not in font:
+            streams.extend(proc.get_object() for proc in font.get("/CharProcs", {}).get_object().values())
+    return streams
+
+def _used_resource_names(page, resources):
+    """页面内容流用到的资源名，包括经由沿用页面资源的表单 / Type3 字体间接用到的"""
+    contents = page.get_contents()
+    used = _resource_names(contents.get_data() if contents is not None else b"")
+    pending, seen = list(used), set()
+    while pending:
+        name = pending.pop()
+        if name in seen: continue
+        seen.add(name)
+        for stream in _inherited_streams(resources, "/" + name.decode()):
+            nested = _resource_names(stream.get_data()) - used
+            used |= nested
+            pending.extend(nested)
+    return used
+
+def _prune_page_resources(page):
+    """移除内容流中没有出现的资源（名称含特殊字符的一律保留）"""
+    resources = page.get("/Resources")
+    if resources is None: return
+    resources = resources.get_object()
+    used = _used_resource_names(page, resources)
+    pruned = DictionaryObject(resources)
+    changed = False
+    for kind in SLIM_RESOURCE_TYPES:
+        if kind not in resources: continue
+        entries = resources[kind].get_object()
+        kept = DictionaryObject({
+            name: value for name, value in entries.items()
+            if not SIMPLE_NAME_PATTERN.match(name) or name[1:].encode() in used
+        })
+        if len(kept) != len(entries):
+            pruned[NameObject(kind)] = kept
+            changed = True
+    if changed: page[NameObject("/Resources")] = pruned
+
+def slim_pdf(pdf):
+    """无损瘦身，返回 (PdfSource, 节省的字节数)；无法处理或没有变小时返回 (原 PdfSource, 0)
+
+    瘦身后的文件与原文件显示内容相同，解析缓存仍按原文件的内容哈希命中。
+    """
+    source = as_pdf_source(pdf)
+    if not PYPDF_AVAILABLE: return source, 0
+    try:
+        with source.open() as f:
+            reader = pypdf.PdfReader(f)
+            if reader.is_encrypted: return source, 0
+            writer = pypdf.PdfWriter(clone_from=reader)
+            for page in writer.pages:
+                if "/Thumb" in page: del page[NameObject("/Thumb")]
+                _prune_page_resources(page)
+                page.compress_content_streams()
+            writer.compress_identical_objects()
+            slimmed = _write_derived(source, writer, "slim")
+    except Exception:
+        return source, 0
+    saved = source.size - slimmed.size
+    if saved <= 0:
+        if slimmed.path: slimmed.path.unlink(missing_ok=True)
+        return source, 0
+    slimmed._sha256 = source.sha256()
+    return slimmed, saved
+
+
+# 批量上传的落盘目录：文件按内容 SHA-256 命名，相同内容只存一份
+SPOOL_DIR = Path("./temp_uploads")
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+def spool_pdf(pdf, spool_dir=SPOOL_DIR):
+    """把 PDF 分块写入内容寻址目录，返回 (sha256, 绝对路径)；同内容文件已存在时不重复写入"""
+    source = as_pdf_source(pdf)
+    spool_dir = Path(spool_dir)
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    temp_path = spool_dir / f".{uuid.uuid4().hex}.part"
+    try:
+        with source.open() as src, open(temp_path, "wb") as dst:
+            for chunk in iter(lambda: src.read(SPOOL_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                dst.write(chunk)
+        path = spool_dir / f"{digest.hexdigest()}.pdf"
+        if path.exists(): temp_path.unlink()
+        else: temp_path.replace(path)
+    finally:
+        if temp_path.exists(): temp_path.unlink()
+    return digest.hexdigest(), path.resolve()
+
+# =========================================================
+# 结果包下载
+# =========================================================
+# 结果包边下载边写入临时文件（内存占用与结果大小无关），之后只解压主 Markdown
+# 和它引用的图片；layout JSON、原始 PDF 等用不到的文件不落盘。
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Markdown 图片语法 ![](path) 与 HTML <img src="path">
+MD_IMAGE_PATTERN = re.compile(r'!\[[^\]]*\]\(\s*<?([^)\s>]+)>?[^)]*\)|<img[^>]+src=["\']([^"\']+)["\']')
+
+def _bundle_members(zf):
+    """结果包中需要解压的成员：主 Markdown（选取规则同 FormatConverter.get_md_file_path）及其引用的图片"""
+    names = [n for n in zf.namelist() if not n.endswith("/")]
+    md_names = [n for n in names if n.lower().endswith(".md")]
+    md_name = (
+        next((n for n in md_names if posixpath.basename(posixpath.dirname(n)) == "auto"), None)
+        or next((n for n in md_names if posixpath.basename(n) == "output.md"), None)
+        or (md_names[0] if md_names else None)
+    )
+    if md_name is None: raise Exception("结果包中没有 Markdown 文件")
+    
+    available = set(names)
+    members = [md_name]
+    base = posixpath.dirname(md_name)
+    content = zf.read(md_name).decode("utf-8", errors="ignore")
+    for match in MD_IMAGE_PATTERN.finditer(content):
+        ref = _local_image_ref(match)
+        if ref is None: continue
+        name = posixpath.normpath(posixpath.join(base, ref))
+        if name in available and name not in members: members.append(name)
+    return members
+
+def _local_image_ref(match):
+    """MD_IMAGE_PATTERN 匹配 -> 本地图片的相对路径；http(s)://、data: 等外部资源返回 None"""
+    ref = unquote(match.group(1) or match.group(2))
+    if re.match(r'^[a-zA-Z][a-zA-Z0-9+.-]*:', ref): return None
+    return ref.split("#")[0].split("?")[0]
+
+def download_result_bundle(url, extract_path, session=None, deadline=None):
+    """流式下载结果包并选择性解压到 extract_path（已存在则清空），返回 extract_path"""
+    extract_path = Path(extract_path)
+    if extract_path.exists(): shutil.rmtree(extract_path)
+    extract_path.mkdir(parents=True, exist_ok=True)
+    
+    zip_path = extract_path / "result.zip.part"
+    try:
+        with guarded_request("GET", url, deadline=deadline, session=session, stream=True, timeout=300) as r:
+            if r.status_code != 200: raise Exception(f"HTTP {r.status_code}")
+            with open(zip_path, "wb") as f:
+                for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    if deadline: deadline.check()
+                    f.write(chunk)
+        with zipfile.ZipFile(zip_path, "r") as z:
+            for name in _bundle_members(z): z.extract(name, extract_path)
+    finally:
+        if zip_path.exists(): zip_path.unlink()
+    return extract_path
+
+# =========================================================
+# 1. Doc2X API 客户端 (⭐ 修改：增加 silent 参数支持多线程)
+# =========================================================
+class Doc2XPDFClient:
+    def __init__(self, api_key, deadline=None, pages=None, output_dir=None):
+        self.api_key = api_key
+        self.base_url = "https://v2.doc2x.noedgeai.com"
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        self.limiter = get_limiter("doc2x", api_key)
+        self.breaker = get_breaker("doc2x")
+        self.session = get_session("doc2x")
+        # 整个任务的总预算，各阶段超时在此基础上截取
+        self.deadline = deadline or Deadline(JOB_TIMEOUT_SECONDS)
+        # 估算页数，决定没有进度信息时的轮询起步间隔
+        self.pages = pages
+        # 结果目录，默认 ./output/<文件名>（批量任务按任务区分，见 job_output_dir）
+        self.output_dir = Path(output_dir) if output_dir else None
+
+    def _api(self, method, path, deadline=None, **kwargs):
+        """所有 Doc2X 接口调用都经过同一 Key 的限流器和引擎熔断器，瞬时错误退避重试"""
+        res = guarded_request(method, f"{self.base_url}{path}", self.limiter, self.breaker,
+                              deadline or self.deadline, session=self.session, headers=self.headers, **kwargs)
+        if res.status_code != 429 and is_quota_error(res): raise QuotaExceededError(f"API Key 额度不足: {res.text}")
+        return res
+
+    def process(self, file_path, silent=False, on_stage=None, resume=None, on_running=None):
+        """完整流程；resume 为任务日志记录时，跳过已完成的阶段，on_stage(stage, **ids) 上报进度
+
+        on_running() 在引擎开始实际解析时调用（对冲解析据此判断是否需要启用备用引擎）。
+        file_path 可以是路径或 PdfSource（直接从内存缓冲区上传）。
+        """
+        source = as_pdf_source(file_path)
+        resume = resume or {}
+        on_stage = on_stage or (lambda stage, **info: None)
+        done = resume.get("stage")
+        
+        # 从提交到拿到结果链接期间占用一个“进行中解析”名额
+        with self.limiter.parse_slot():
+            if stage_reached(done, STAGE_PARSE_SUBMITTED) and resume.get("remote_id"):
+                uid = resume["remote_id"]
+            else:
+                submit_deadline = self.deadline.stage("submit", "提交")
+                uid, upload_url = self._preupload(silent, submit_deadline)
+                self._upload_file(source, upload_url, silent, submit_deadline)
+                on_stage(STAGE_PARSE_SUBMITTED, remote_id=uid)
+            
+            if not stage_reached(done, STAGE_PARSE_DONE):
+                self._wait_for_parsing(uid, silent, on_running)
+                on_stage(STAGE_PARSE_DONE)
+            
+            # 导出链接有时效，续跑时重新查询一次结果即可拿到新链接
+            if not stage_reached(done, STAGE_EXPORTED):
+                self._trigger_export(uid, silent)
+            download_url = self._wait_for_export_result(uid)
+            on_stage(STAGE_EXPORTED, download_url=download_url)
+        return self._download_and_extract(download_url, source, silent)
+
+    def _preupload(self, silent=False, deadline=None):
+        if not silent: st.toast("1. 请求上传链接...", icon="☁️")
+        res = self._api("POST", "/api/v2/parse/preupload", deadline=deadline)
+        if res.status_code != 200: raise Exception(f"预上传失败: {res.text}")
+        data = res.json()
+        if data["code"] != "success": raise Exception(str(data))
+        return data["data"]["uid"], data["data"]["url"]
+
+    def _upload_file(self, source, upload_url, silent=False, deadline=None):
+        if not silent: st.toast("2. 上传文件...", icon="📤")
+        res = guarded_request("PUT", upload_url, deadline=deadline or self.deadline, session=self.session,
+                              data=source.open, timeout=300)
+        if res.status_code != 200: raise Exception(f"文件上传失败: HTTP {res.status_code}")
+
+    def _wait_for_parsing(self, uid, silent=False, on_running=None):
+        if not silent: st.toast("3. AI 正在解析...", icon="🧠")
+        deadline = self.deadline.stage("parse", "解析")
+        
+        progress_text = None
+        bar = None
+        if not silent:
+            progress_text = st.empty()
+            bar = st.progress(0)
+        latest = {"progress": 0}
+        schedule = AdaptiveInterval(pages=self.pages)
+        
+        # 由统一轮询器调用（不在当前线程），只记录进度，界面在 show() 里刷新
+        def poll():
+            res = self._api("GET", "/api/v2/parse/status", deadline=deadline, params={"uid": uid})
+            if res.status_code != 200: raise Exception(f"查询解析状态失败: HTTP {res.status_code}")
+            data = res.json()
+            if data.get("code") != "success": 
+                if data.get("code") == "parse_error": raise Exception(data.get("msg"))
+                return False, None
+            
+            info = data.get("data") or {}
+            status = info.get("status")
+            latest["progress"] = info.get("progress", 0)
+            schedule.observe(latest["progress"] / 100)
+            if on_running and status in ("processing", "success"): on_running()
+            
+            if status == "success": return True, None
+            elif status == "failed": raise Exception(info.get("detail"))
+            return False, None
+        
+        def show():
+            bar.progress(min(latest["progress"] / 100, 1.0))
+            progress_text.text(f"解析进度: {latest['progress']}%")
+        
+        wait_for(get_status_poller().watch(poll, schedule.next_delay, deadline), None if silent else show, deadline=deadline)
+        if not silent and bar:
+            bar.progress(1.0)
+            progress_text.empty()
+
+    def _trigger_export(self, uid, silent=False):
+        if not silent: st.toast("4. 请求导出格式...", icon="⚙️")
+        res = self._api("POST", "/api/v2/convert/parse", deadline=self.deadline.stage("export", "导出"),
+                        json={"uid": uid, "to": "md", "formula_mode": "normal", "filename": "output"})
+        if res.status_code != 200: raise Exception(f"请求导出失败: {res.text}")
+
+    def _wait_for_export_result(self, uid):
+        # 此处不涉及 UI，无需 silent
+        deadline = self.deadline.stage("export", "导出")
+        
+        def poll():
+            res = self._api("GET", "/api/v2/convert/parse/result", deadline=deadline, params={"uid": uid})
+            if res.status_code != 200: raise Exception(f"查询导出结果失败: HTTP {res.status_code}")
+            data = res.json()
+            info = data.get("data") or {}
+            if data.get("code") == "success" and info.get("status") == "success" and info.get("url"):
+                return True, info["url"]
+            elif info.get("status") == "failed": raise Exception("导出失败")
+            return False, None
+        
+        # 导出没有进度信息：先快速查询，之后逐步拉长间隔
+        return wait_for(get_status_poller().watch(poll, AdaptiveInterval().next_delay, deadline), deadline=deadline)
+
+    def _download_and_extract(self, url, original_file, silent=False):
+        if not silent: st.toast("5. 下载资源包...", icon="📥")
+        try:
+            return download_result_bundle(
+                url, self.output_dir or Path(f"./output/{original_file.stem}"), self.session,
+                self.deadline.stage("download", "下载")
+            )
+        except Exception as e: raise Exception(f"下载结果失败: {str(e)}")
+
+# =========================================================
+# 2. MinerU 在线 API 客户端 (⭐ 修改：增加 silent 参数)
+# =========================================================
+class MinerUOnlineClient:
+    def __init__(self, api_key, deadline=None, pages=None, output_dir=None):
+        self.api_key = api_key
+        self.base_url = "https://mineru.net/api/v4"
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+        self.limiter = get_limiter("mineru", api_key)
+        self.breaker = get_breaker("mineru")
+        self.session = get_session("mineru")
+        # 整个任务的总预算，各阶段超时在此基础上截取
+        self.deadline = deadline or Deadline(JOB_TIMEOUT_SECONDS)
+        # 估算页数，决定没有进度信息时的轮询起步间隔
+        self.pages = pages
+        # 结果目录，默认 ./output/<文件名>（批量任务按任务区分，见 job_output_dir）
+        self.output_dir = Path(output_dir) if output_dir else None
+
+    def _api(self, method, path, deadline=None, **kwargs):
+        """所有 MinerU 接口调用都经过同一 Key 的限流器和引擎熔断器，瞬时错误退避重试"""
+        res = guarded_request(method, f"{self.base_url}{path}", self.limiter, self.breaker,
+                              deadline or self.deadline, session=self.session, headers=self.headers, **kwargs)
+        if res.status_code != 429 and is_quota_error(res): raise QuotaExceededError(f"API Key 额度不足: {res.text}")
+        return res
+
+    def process(self, file_path, force_ocr=False, silent=False, on_stage=None, resume=None, on_running=None):
+        """完整流程；resume 为任务日志记录时，跳过已完成的阶段，on_stage(stage, **ids) 上报进度
+
+        on_running() 在引擎开始实际解析时调用（对冲解析据此判断是否需要启用备用引擎）。
+        file_path 可以是路径或 PdfSource（直接从内存缓冲区上传）。
+        """
+        original_file = as_pdf_source(file_path)
+        resume = resume or {}
+        on_stage = on_stage or (lambda stage, **info: None)
+        
+        # 从提交到拿到结果链接期间占用一个“进行中解析”名额
+        with self.limiter.parse_slot():
+            if stage_reached(resume.get("stage"), STAGE_PARSE_SUBMITTED) and resume.get("remote_id"):
+                batch_id = resume["remote_id"]
+            else:
+                submit_deadline = self.deadline.stage("submit", "提交")
+                if not silent: st.toast("1. 申请上传链接...", icon="🔗")
+                # 后台任务短暂等待同一 Key 的其他文件，合并成一个 batch；前台单文件直接提交
+                window = MINERU_BATCH_WINDOW if silent else 0
+                upload_url, batch_id = self._get_upload_url(original_file.name, force_ocr, submit_deadline, window)
+                
+                if not silent: st.toast("2. 上传文件到解析中心...", icon="📤")
+                self._upload_file(original_file, upload_url, submit_deadline)
+                on_stage(STAGE_PARSE_SUBMITTED, remote_id=batch_id)
+            
+            # MinerU 解析完成即给出结果包链接，parse_done 与 exported 同时达成
+            if not silent: st.toast("3. AI 正在解析...", icon="🧠")
+            download_url = self._wait_for_result(batch_id, original_file.name, silent, on_running)
+            on_stage(STAGE_PARSE_DONE)
+            on_stage(STAGE_EXPORTED, download_url=download_url)
+        
+        if not silent: st.toast("4. 下载解析结果...", icon="📥")
+        output_dir = self._download_and_extract(download_url, original_file)
+        
+        return output_dir
+
+    def _get_upload_url(self, filename, force_ocr=False, deadline=None, window=0):
+        """取得本文件的上传链接和 batch_id；window 秒内到达的同 Key 文件合并为一个 batch"""
+        return _mineru_batcher.upload_url(self, filename, force_ocr, deadline, window)
+
+    def _request_upload_urls(self, filenames, force_ocr=False, deadline=None):
+        """一次为多个文件申请上传链接，返回 (链接列表, batch_id)
+
+        配置了回调接收器时同时登记回调地址，文件解析完成的通知会唤醒该 batch 的轮询。
+        """
+        data = {
+            "files": [{"name": name} for name in filenames],
+            "model_version": "vlm",
+            "enable_formula": True,
+            "enable_table": True,
+            "force_ocr": force_ocr
+        }
+        receiver = get_callback_receiver()
+        target = {}
+        if receiver:
+            data["callback"], token = receiver.register(
+                lambda body: target and get_status_poller().wake(("mineru", target["batch_id"]))
+            )
+            # 回调签名用的 seed 与地址里的令牌相互独立（MinerU 只接受字母、数字和下划线）
+            data["seed"] = secrets.token_hex(8)
+        try:
+            res = self._api("POST", "/file-urls/batch", deadline=deadline, json=data)
+            if res.status_code != 200: raise Exception(f"申请上传链接失败: HTTP {res.status_code}")
+            result = res.json()
+            if result["code"] != 0: raise Exception(f"解析错误: {result.get('msg', '未知错误')}")
+        except Exception:
+            if receiver: receiver.unregister(token)
+            raise
+        target["batch_id"] = result["data"]["batch_id"]
+        return result["data"]["file_urls"], result["data"]["batch_id"]
+
+    def _upload_file(self, source, upload_url, deadline=None):
+        res = guarded_request("PUT", upload_url, deadline=deadline or self.deadline, session=self.session,
+                              data=source.open, timeout=300)
+        if res.status_code != 200: raise Exception(f"文件上传失败: HTTP {res.status_code}")
+
+    def _wait_for_result(self, batch_id, filename, silent=False, on_running=None):
+        progress_text = None
+        bar = None
+        if not silent:
+            progress_text = st.empty()
+            bar = st.progress(0)
+        
+        deadline = self.deadline.stage("parse", "解析")
+        latest = {}
+        
+        # 由同一 batch 的共享轮询调用（不在当前线程），只记录状态，界面在 show() 里刷新
+        def on_update(file_result):
+            latest.update(file_result)
+            if on_running and file_result.get("state") in ("running", "done"): on_running()
+        
+        def show():
+            if latest.get("state") != "running": return
+            if "extract_progress" in latest:
+                prog = latest["extract_progress"]
+                extracted = prog.get("extracted_pages", 0)
+                total = prog.get("total_pages") or 1
+                percent = min(0.2 + (extracted / total) * 0.6, 0.8)
+                bar.progress(percent)
+                progress_text.text(f"解析中: {extracted}/{total} 页")
+            else:
+                bar.progress(0.5)
+                progress_text.text("正在解析...")
+        
+        future = _mineru_watch.watch(self, batch_id, filename, on_update)
+        try:
+            download_url = wait_for(future, None if silent else show, deadline=deadline)
+        finally:
+            _mineru_watch.release(batch_id, filename, future)
+        if not silent:
+            bar.progress(1.0)
+            progress_text.empty()
+            st.toast("✅ 解析完成！", icon="🎉")
+        return download_url
+
+    def _download_and_extract(self, download_url, original_file):
+        try:
+            return download_result_bundle(
+                download_url, self.output_dir or Path(f"./output/{original_file.stem}"), self.session,
+                self.deadline.stage("download", "下载")
+            )
+        except Exception as e: raise Exception(f"下载结果失败: {str(e)}")
+
+# ---------------------------------------------------------
+# MinerU 批量提交与共享轮询
+# ---------------------------------------------------------
+# /file-urls/batch 一次可以为多个文件申请上传链接，/extract-results/batch/{batch_id}
+# 一次返回整批的状态。后台任务各自运行，但同一 Key 在 MINERU_BATCH_WINDOW 秒内到达的文件
+# 会合并成一个 batch（第一个到达的任务代表整组申请链接，各任务再并行上传自己的文件）；
+# 等待结果时同一 batch 只有一路轮询，每次查询同时更新组内所有文件。
+# 一组的大小受同时运行的任务数限制（侧边栏并发数 / worker --concurrency）。
+MINERU_BATCH_SIZE = int(os.environ.get("MINERU_BATCH_SIZE", 20))
+MINERU_BATCH_WINDOW = float(os.environ.get("MINERU_BATCH_WINDOW", 1.0))
+# 启用完成回调后的兜底轮询间隔（秒）
+CALLBACK_FALLBACK_POLL = float(os.environ.get("PDF_CALLBACK_FALLBACK_POLL", 15))
+
+
+class MinerUBatcher:
+    def __init__(self, max_size=MINERU_BATCH_SIZE):
+        self.max_size = max(1, int(max_size))
+        self._lock = threading.Lock()
+        self._open = {}  # (api_key, force_ocr) -> 正在收集的组
+
+    def upload_url(self, client, filename, force_ocr, deadline, window):
+        """加入（或新开）一个组，等整组申请到链接后返回本文件的 (上传链接, batch_id)"""
+        if window <= 0:
+            urls, batch_id = client._request_upload_urls([filename], force_ocr, deadline)
+            return urls[0], batch_id
+        key = (client.api_key, force_ocr)
+        with self._lock:
+            group = self._open.get(key)
+            # 同名文件在一个 batch 里无法区分结果，另开一组
+            if group is None or filename in group["files"]:
+                group = {"files": [], "full": threading.Event(), "done": threading.Event(), "result": None, "error": None}
+                self._open[key] = group
+                leader = True
+            else:
+                leader = False
+            index = len(group["files"])
+            group["files"].append(filename)
+            if len(group["files"]) >= self.max_size:
+                self._open.pop(key, None)
+                group["full"].set()
+        
+        if leader:
+            group["full"].wait(min(window, deadline.remaining()) if deadline else window)
+            with self._lock:
+                if self._open.get(key) is group: self._open.pop(key)
+            try:
+                group["result"] = client._request_upload_urls(group["files"], force_ocr, deadline)
+            except Exception as e:
+                group["error"] = e
+            finally:
+                group["done"].set()
+        else:
+            group["done"].wait()
+        
+        if group["error"]: raise group["error"]
+        urls, batch_id = group["result"]
+        return urls[index], batch_id
+
+
+class MinerUBatchWatch:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._batches = {}    # batch_id -> {文件名: (Future, on_update)}
+        self._schedules = {}  # batch_id -> 整批共用的 AdaptiveInterval
+
+    def watch(self, client, batch_id, filename, on_update=None):
+        """登记等待 batch 内的一个文件，返回 Future（结果为下载链接）；该 batch 没有轮询时启动一路
+
+        轮询起步间隔按组内最大的页数估算（client.pages），与单文件轮询一致。
+        """
+        future = Future()
+        with self._lock:
+            waiters = self._batches.get(batch_id)
+            start = waiters is None
+            if start: waiters = self._batches[batch_id] = {}
+            waiters[filename] = (future, on_update)
+            if start:
+                # 启用回调时完成通知会立即唤醒查询，轮询只作兜底，间隔放宽
+                if get_callback_receiver():
+                    schedule = AdaptiveInterval(initial=CALLBACK_FALLBACK_POLL, pages=client.pages, minimum=CALLBACK_FALLBACK_POLL)
+                else:
+                    schedule = AdaptiveInterval(initial=3, pages=client.pages)
+                self._schedules[batch_id] = schedule
+            else:
+                schedule = self._schedules.get(batch_id)
+                if schedule: schedule.expect_pages(client.pages)
+        if start:
+            # 整批共用的截止时间；单个文件的超时 / 取消由各自的等待方处理
+            deadline = Deadline(STAGE_TIMEOUTS["parse"], "解析")
+            batch = get_status_poller().watch(
+                lambda: self._poll(client, batch_id, deadline, schedule), schedule.next_delay, deadline,
+                key=("mineru", batch_id)
+            )
+            batch.add_done_callback(lambda f: self._finish(batch_id, f))
+        return future
+
+    def _finish(self, batch_id, batch):
+        with self._lock:
+            self._schedules.pop(batch_id, None)
+        # 查询出错 / 整批超时：组内所有等待方一起失败
+        if batch.exception(): self._fail_all(batch_id, batch.exception())
+
+    def release(self, batch_id, filename, future):
+        """等待方退出（完成、超时或被取消）后注销；batch 内没有等待方时轮询随之结束"""
+        with self._lock:
+            waiters = self._batches.get(batch_id)
+            if waiters and waiters.get(filename, (None,))[0] is future:
+                del waiters[filename]
+
+    def _fail_all(self, batch_id, error):
+        with self._lock:
+            waiters = self._batches.pop(batch_id, None) or {}
+        for future, _ in waiters.values():
+            if not future.done(): future.set_exception(error)
+
+    def _poll(self, client, batch_id, deadline, schedule):
+        with self._lock:
+            waiters = dict(self._batches.get(batch_id) or {})
+            if not waiters:
+                self._batches.pop(batch_id, None)
+                return True, None
+        
+        res = client._api("GET", f"/extract-results/batch/{batch_id}", deadline=deadline)
+        if res.status_code != 200: raise Exception(f"查询解析结果失败: HTTP {res.status_code}")
+        result = res.json()
+        if result.get("code") != 0: return False, None
+        
+        extracted = total = 0
+        for file_result in (result.get("data") or {}).get("extract_result") or []:
+            prog = file_result.get("extract_progress") or {}
+            extracted += prog.get("extracted_pages", 0) if file_result.get("state") != "done" else prog.get("total_pages", 0)
+            total += prog.get("total_pages", 0)
+            
+            waiter = waiters.get(file_result.get("file_name"))
+            if not waiter: continue
+            future, on_update = waiter
+            if on_update: on_update(file_result)
+            state = file_result.get("state")
+            if state == "done" and not future.done():
+                future.set_result(file_result["full_zip_url"])
+            elif state == "failed" and not future.done():
+                future.set_exception(Exception(f"解析失败: {file_result.get('err_msg', '未知错误')}"))
+        if total: schedule.observe(extracted / total)
+        
+        with self._lock:
+            # 已出结果的文件不再需要轮询
+            waiters = self._batches.get(batch_id) or {}
+            for name in [n for n, (f, _) in waiters.items() if f.done()]: del waiters[name]
+            if not waiters:
+                self._batches.pop(batch_id, None)
+                return True, None
+        return False, None
+
+
+_mineru_batcher = MinerUBatcher()
+_mineru_watch = MinerUBatchWatch()
+
+# =========================================================
+# 本地文字层提取 (pypdf，不经过网络)
+# =========================================================
+# 没有公式和表格的文字型 PDF 直接读文字层，一秒内完成，不占云端额度。
+# 输出与云端引擎相同的目录结构 ./output/<文件名>/output.md，后续重命名、转换流程不变。
+# 每页文字按行重组段落：行尾是句末标点且明显短于本页最长行时分段，
+# 行尾连字符与下一行小写开头拼接，中文行之间不加空格。
+SENTENCE_END = tuple("。！？；：.!?;:」』”’)）")
+
+def _is_cjk(ch):
+    return "\u3000" <= ch <= "\u9fff" or "\uff00" <= ch <= "\uffef"
+
+def text_to_markdown(text):
+    """pypdf 提取的单页文字 -> Markdown 段落"""
+    lines = [line.strip() for line in text.splitlines()]
+    width = max((len(line) for line in lines), default=0)
+    paragraphs, current = [], ""
+    for line in lines:
+        if not line:
+            if current: paragraphs.append(current)
+            current = ""
+            continue
+        if not current: current = line
+        elif current.endswith("-") and line[0].islower(): current = current[:-1] + line
+        elif _is_cjk(current[-1]) or _is_cjk(line[0]): current += line
+        else: current += " " + line
+        if line.endswith(SENTENCE_END) and len(line) < width * 0.8:
+            paragraphs.append(current)
+            current = ""
+    if current: paragraphs.append(current)
+    return "\n\n".join(paragraphs)
+
+
+class LocalTextClient:
+    def __init__(self, deadline=None, output_dir=None):
+        self.deadline = deadline or Deadline(JOB_TIMEOUT_SECONDS)
+        self.output_dir = Path(output_dir) if output_dir else None
+
+    def process(self, file_path, silent=False, on_stage=None, resume=None, on_running=None):
+        """与云端客户端相同的接口；resume 无需处理（本地提取没有远端状态）"""
+        if not PYPDF_AVAILABLE: raise Exception("未安装 pypdf，无法使用本地提取")
+        source = as_pdf_source(file_path)
+        on_stage = on_stage or (lambda stage, **info: None)
+        if on_running: on_running()
+        
+        bar = None if silent else st.progress(0, text="本地提取文字...")
+        pages = []
+        with source.open() as f:
+            reader = pypdf.PdfReader(f)
+            total = len(reader.pages)
+            for number, page in enumerate(reader.pages, 1):
+                self.deadline.check()
+                pages.append(text_to_markdown(page.extract_text() or ""))
+                if bar: bar.progress(number / total, text=f"本地提取文字: {number}/{total} 页")
+        on_stage(STAGE_PARSE_DONE)
+        
+        output_dir = self.output_dir or Path(f"./output/{source.stem}")
+        if output_dir.exists(): shutil.rmtree(output_dir)
+        output_dir.mkdir(parents=True)
+        (output_dir / "output.md").write_text("\n\n".join(p for p in pages if p) + "\n", encoding="utf-8")
+        return output_dir
+
+# =========================================================
+# 3. 格式转换器 (修正路径错误)
+# =========================================================
+class FormatConverter:
+    @staticmethod
+    def save_md_content(content, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+    @staticmethod
+    def get_md_file_path(folder):
+        md_files = list(folder.glob("**/auto/*.md"))
+        if not md_files: md_files = list(folder.glob("**/output.md"))
+        if not md_files: md_files = list(folder.glob("**/*.md"))
+        return md_files[0] if md_files else None
+
+    @staticmethod
+    def normalize_math_formulas(md_content):
+        if not md_content: return ""
+        md_content = re.sub(r'\\\(\s*', '$', md_content)
+        md_content = re.sub(r'\s*\\\)', '$', md_content)
+        md_content = re.sub(r'\\\[\s*', '\n$$\n', md_content)
+        md_content = re.sub(r'\s*\\\]', '\n$$\n', md_content)
+        return md_content
+
+    @staticmethod
+    def clean_image_captions(md_content):
+        if not md_content: return ""
+        return re.sub(r'!\[([^\]]*)\]\(([^\)]+)\)', r'![](\2)', md_content)
+
+    @staticmethod
+    def run_pandoc(input_file, output_file, format_type, source_filename=None, math_mode="mathml"):
+        # 强制转换为绝对路径，解决路径查找问题
+        input_path = Path(input_file).resolve()
+        cwd = input_path.parent
+        
+        temp_input = None
+        css_file = None 
+
+        # 预处理 MD
+        if input_path.suffix.lower() == '.md':
+            with open(input_path, 'r', encoding='utf-8') as f: content = f.read()
+            content = FormatConverter.normalize_math_formulas(content)
+            content = FormatConverter.clean_image_captions(content)
+            
+            # 临时文件创建在同一目录下
+            temp_input = cwd / f"temp_fix_{input_path.name}"
+            with open(temp_input, 'w', encoding='utf-8') as f: f.write(content)
+            # 传递给命令时使用文件名即可（因为设置了 cwd）
+            target_input = temp_input.name
+        else:
+            target_input = input_path.name
+
+        # 输出路径必须是绝对路径
+        cmd = ["pandoc", target_input, "-o", str(output_file.resolve())]
+        
+        if format_type == "epub":
+            title = Path(source_filename).stem if source_filename else input_path.stem
+            metadata_file = cwd / "metadata.yaml"
+            with open(metadata_file, "w", encoding="utf-8") as f:
+                f.write(f"---\ntitle: {title}\n---\n")
+            
+            css_file = cwd / "epub_fix.css"
+            with open(css_file, "w", encoding="utf-8") as f:
+                f.write("h1, h2, h3 { page-break-before: avoid !important; break-before: avoid !important; }")
+
+            cmd.extend([
+                "--standalone", "--toc",
+                # ⭐ 关键修改：使用 .resolve() 传递绝对路径
+                "--metadata-file", str(metadata_file.resolve()),
+                "--css", str(css_file.resolve()), 
+                "-f", "markdown+tex_math_dollars"
+            ])
+
+            if math_mode == "mathml": cmd.append("--mathml")
+            elif math_mode == "webtex": cmd.append("--webtex")
+            elif math_mode == "mathjax": cmd.append("--mathjax")
+            
+        elif format_type == "docx":
+            cmd.extend(["--standalone", "-f", "markdown+tex_math_dollars"])
+
+        cmd.append("--resource-path=.")
+
+        try:
+            # 运行 Pandoc
+            subprocess.run(cmd, cwd=cwd, check=True, capture_output=True, text=True)
+        except subprocess.CalledProcessError as e:
+            # 打印更详细的错误信息
+            raise Exception(f"Pandoc 转换失败 (路径: {cwd}): {e.stderr}")
+        finally:
+            # 清理临时文件
+            if temp_input and temp_input.exists(): temp_input.unlink()
+            if format_type == "epub":
+                if metadata_file.exists(): metadata_file.unlink()
+                if css_file and css_file.exists(): css_file.unlink()# ⭐ 清理 CSS
+
+# =========================================================
+# 4. 文档统计工具
+# =========================================================
+# 无法读取页数时，按每页约 100 KB 估算（扫描件的典型大小）
+BYTES_PER_PAGE_ESTIMATE = 100 * 1024
+
+# 自动 OCR 判断：均匀抽取若干页读取文字层
+OCR_PROBE_PAGES = int(os.environ.get("PDF_OCR_PROBE_PAGES", 8))
+# 一页至少有这么多可读字符才算有文字层
+OCR_MIN_PAGE_CHARS = 50
+# 乱码字符（私用区、替换符、控制字符）占比超过该值，视为文字层损坏（字体编码缺失的 PDF 常见）
+OCR_MAX_GARBLED_RATIO = 0.2
+# 文字层完好的页数占抽样页数的比例低于该值时启用 OCR
+OCR_TEXT_PAGE_RATIO = 0.7
+# 自动选择本地提取的条件：抽样页文字层完好的比例不低于该值，且数学符号少于 LOCAL_MAX_MATH_SYMBOLS 个
+LOCAL_TEXT_PAGE_RATIO = 0.9
+LOCAL_MAX_MATH_SYMBOLS = 5
+MATH_SYMBOL_PATTERN = re.compile(r'[∑∏∫∮√∞∂∇≈≠≡≤≥±∓×÷∈∉⊂⊃⊆⊇∪∩∀∃→⇒⇔αβγδεζηθκλμνξπρστφχψωΓΔΘΛΞΠΣΦΨΩ]')
+
+def _garbled_ratio(text):
+    chars = [ch for ch in text if not ch.isspace()]
+    if not chars: return 0.0
+    bad = sum(1 for ch in chars if ch == "\ufffd" or unicodedata.category(ch) in ("Co", "Cc", "Cn"))
+    return bad / len(chars)
+
+class DocumentStats:
+    @staticmethod
+    def count_pdf_pages(pdf_path):
+        if not PYPDF_AVAILABLE: return None
+        try:
+            with as_pdf_source(pdf_path).open() as f: return len(pypdf.PdfReader(f).pages)
+        except Exception: return None
+    
+    @staticmethod
+    def estimate_parse_cost(pdf_path):
+        """估算解析代价（以页数计），用于短作业优先调度；读不出页数时按文件大小折算"""
+        pages = DocumentStats.count_pdf_pages(pdf_path)
+        if pages: return float(pages)
+        try:
+            return max(1.0, as_pdf_source(pdf_path).size / BYTES_PER_PAGE_ESTIMATE)
+        except OSError:
+            return None
+    
+    @staticmethod
+    def probe_text_layer(pdf_path, samples=OCR_PROBE_PAGES):
+        """均匀抽样几页检查文字层，返回 {"sampled", "text_pages", "math_symbols", "needs_ocr"}；读不出时返回 None
+
+        每个文件的抽样在该文件自己的任务线程中进行，批量任务的多个文件同时预检。
+        """
+        if not PYPDF_AVAILABLE: return None
+        try:
+            with as_pdf_source(pdf_path).open() as f:
+                reader = pypdf.PdfReader(f)
+                total = len(reader.pages)
+                if not total: return None
+                count = min(total, max(1, samples))
+                text_pages = math_symbols = 0
+                for number in sorted({int((i + 0.5) * total / count) for i in range(count)}):
+                    text = reader.pages[number].extract_text() or ""
+                    math_symbols += len(MATH_SYMBOL_PATTERN.findall(text))
+                    if len(text.strip()) >= OCR_MIN_PAGE_CHARS and _garbled_ratio(text) <= OCR_MAX_GARBLED_RATIO:
+                        text_pages += 1
+        except Exception:
+            return None
+        return {
+            "sampled": count, "text_pages": text_pages, "math_symbols": math_symbols,
+            "needs_ocr": text_pages < count * OCR_TEXT_PAGE_RATIO,
+        }
+    
+    @staticmethod
+    def count_markdown_words(md_content):
+        if not md_content: return 0, 0, 0
+        md_content = re.sub(r'```[\s\S]*?```', '', md_content)
+        md_content = re.sub(r'\$\$[\s\S]*?\$\$', '', md_content)
+        chinese_chars = len(re.findall(r'[\u4e00-\u9fff]', md_content))
+        english_words = len(re.findall(r'\b[a-zA-Z]+\b', md_content))
+        return chinese_chars + english_words, chinese_chars, english_words
+        
+def is_simple_text_pdf(pdf_path, probe=None):
+    """文字层完整、没有明显公式的 PDF（可以交给本地提取）；表格无法从文字层可靠判断，不在此检查
+
+    probe 为已有的 probe_text_layer 结果时直接使用，不再抽样。
+    """
+    probe = probe or DocumentStats.probe_text_layer(pdf_path)
+    if not probe: return False
+    return probe["text_pages"] >= probe["sampled"] * LOCAL_TEXT_PAGE_RATIO and probe["math_symbols"] < LOCAL_MAX_MATH_SYMBOLS
+
+def resolve_force_ocr(force_ocr, pdf_path, probe=None):
+    """force_ocr 为 None（自动）时按文字层抽样结果决定；抽样失败时不强制 OCR（由引擎自行判断）
+
+    只有 MinerU 有 OCR 开关，调用方应在选定引擎之后、且引擎为 mineru 时再调用。
+    probe 为已有的 probe_text_layer 结果时直接使用，不再抽样。
+    """
+    if force_ocr is not None: return bool(force_ocr)
+    probe = probe or DocumentStats.probe_text_layer(pdf_path)
+    return bool(probe and probe["needs_ocr"])
+
+# =========================================================
+# 解析结果缓存 (parse_cache.py)
+# =========================================================
+def _cache_options(engine, force_ocr):
+    """影响解析结果的选项，作为缓存键的一部分（Doc2X 没有 OCR 开关）"""
+    return {"force_ocr": bool(force_ocr)} if engine == "mineru" else {}
+
+def restore_cached_parse(engine, pdf, force_ocr=False, output_dir=None):
+    """同一内容、同一引擎和选项解析过时，把缓存的结果包复制到 output_dir（默认 ./output/<文件名>）并返回该目录；未命中返回 None"""
+    cache = get_parse_cache()
+    if not cache.enabled: return None
+    source = as_pdf_source(pdf)
+    target = output_dir or Path(f"./output/{source.stem}")
+    return cache.restore(source.sha256(), engine, _cache_options(engine, force_ocr), target)
+
+def store_cached_parse(engine, pdf, force_ocr, output_dir, replace=False):
+    cache = get_parse_cache()
+    if not cache.enabled: return
+    cache.put(as_pdf_source(pdf).sha256(), engine, _cache_options(engine, force_ocr), output_dir, replace=replace)
+
+# =========================================================
+# ⭐ 修改：单文件任务处理 (支持保持原文件名)
+# =========================================================
+def parse_with_key_pool(engine, api_keys, pdf_path, force_ocr=False, silent=False, on_stage=None, resume=None, cost=None, deadline=None, on_running=None, use_cache=True, output_dir=None):
+    """从 Key 池中选一个 Key 完成解析，返回结果目录
+
+    提交时遇到额度耗尽会把该 Key 移出当天轮换并换下一个 Key 重试；
+    续跑任务必须使用原来提交的 Key（远端 ID 只对该账号有效）。
+    deadline 为整个任务的总预算，换 Key 重试也计入其中。
+    use_cache 为 True 时先查解析缓存，命中直接返回；为 False 时强制重新解析，并用新结果覆盖缓存。
+    output_dir 为结果目录，默认 ./output/<文件名>。
+    """
+    pdf_path = as_pdf_source(pdf_path)  # 查缓存和上传共用一次内容哈希
+    if use_cache:
+        cached = restore_cached_parse(engine, pdf_path, force_ocr, output_dir)
+        if cached: return cached
+    target_dir = output_dir
+    deadline = deadline or Deadline(JOB_TIMEOUT_SECONDS)
+    pool = KeyPool(engine, api_keys)
+    resume = resume or {}
+    on_stage = on_stage or (lambda stage, **info: None)
+    prefer = resume.get("key_id") if stage_reached(resume.get("stage"), STAGE_PARSE_SUBMITTED) else None
+    
+    for _ in range(max(1, len(pool.keys))):
+        with pool.lease(cost, prefer=prefer) as api_key:
+            def report(stage, **fields):
+                if stage == STAGE_PARSE_SUBMITTED:
+                    fields["key_id"] = key_fingerprint(api_key)
+                    pool.record_usage(api_key, cost)
+                on_stage(stage, **fields)
+            try:
+                if engine == "mineru":
+                    output_dir = MinerUOnlineClient(api_key, deadline, cost, target_dir).process(pdf_path, force_ocr=force_ocr, silent=silent, on_stage=report, resume=resume, on_running=on_running)
+                else:
+                    output_dir = Doc2XPDFClient(api_key, deadline, cost, target_dir).process(pdf_path, silent=silent, on_stage=report, resume=resume, on_running=on_running)
+            except QuotaExceededError:
+                pool.mark_exhausted(api_key)
+                if prefer: raise
+                continue
+            store_cached_parse(engine, pdf_path, force_ocr, output_dir, replace=not use_cache)
+            return output_dir
+    raise QuotaExceededError("所有 API Key 今日额度已用完")
+
+# 对冲解析：主引擎超过该秒数仍未开始解析，就同时提交给另一个引擎
+HEDGE_AFTER_SECONDS = float(os.environ.get("PDF_HEDGE_AFTER", 60))
+
+# 本地提取的使用方式
+LOCAL_OFF = "off"        # 只用云端引擎
+LOCAL_AUTO = "auto"      # 简单文字型 PDF 走本地，其余走云端
+LOCAL_ALWAYS = "always"  # 全部本地提取
+
+def select_engine(api_key_doc2x, api_key_mineru, pdf_path=None, local_mode=LOCAL_OFF, probe=None):
+    """按侧边栏配置选择解析引擎：本地提取（按 local_mode）> 期刊增强 (MinerU) > 标准 (Doc2X)
+
+    probe 为已有的文字层抽样结果（见 is_simple_text_pdf）。
+    """
+    if local_mode == LOCAL_ALWAYS: return "local"
+    if local_mode == LOCAL_AUTO and pdf_path is not None and is_simple_text_pdf(pdf_path, probe): return "local"
+    if api_key_mineru: return "mineru"
+    if api_key_doc2x: return "doc2x"
+    return None
+
+def hedged_parse(api_key_doc2x, api_key_mineru, pdf_path, force_ocr=False, on_stage=None, cost=None, deadline=None, hedge_after=HEDGE_AFTER_SECONDS, use_cache=True, output_dir=None):
+    """对冲解析（两个引擎都配置了 Key 时可用），返回 (胜出引擎, 结果目录)
+
+    先提交主引擎（select_engine 的选择）；hedge_after 秒内仍未开始解析（本地排队、服务商 pending 等），
+    再把同一文件提交给另一个引擎。先拿到结果下载链接的一方胜出，另一方被取消，不再轮询和下载。
+    只有主引擎的阶段实时写入任务日志；备用引擎胜出时一次性补写它的远端 ID 和 Key。
+    任一引擎的解析缓存命中时直接返回，不提交。
+    """
+    on_stage = on_stage or (lambda stage, **info: None)
+    deadline = deadline or Deadline(JOB_TIMEOUT_SECONDS)
+    api_keys = {"doc2x": api_key_doc2x, "mineru": api_key_mineru}
+    primary = select_engine(api_key_doc2x, api_key_mineru)
+    backup = "doc2x" if primary == "mineru" else "mineru"
+    pdf_path = as_pdf_source(pdf_path)
+    if use_cache:
+        for engine in (primary, backup):
+            cached = restore_cached_parse(engine, pdf_path, force_ocr, output_dir)
+            if cached: return engine, cached
+    branches = {primary: deadline.fork(), backup: deadline.fork()}
+    lock = threading.Lock()
+    winner = []
+    started = threading.Event()
+    
+    def run(engine):
+        pending = {}
+        
+        def report(stage, **fields):
+            with lock:
+                if winner and winner[0] != engine: raise JobCancelledError("另一引擎已先完成")
+                if stage == STAGE_EXPORTED and not winner:
+                    winner.append(engine)
+                    for other, branch in branches.items():
+                        if other != engine: branch.cancel()
+                if engine == primary:
+                    on_stage(stage, engine=engine, **fields)
+                elif winner:
+                    on_stage(stage, engine=engine, **{**pending, **fields})
+                else:
+                    pending.update(fields)
+        
+        return parse_with_key_pool(
+            engine, api_keys[engine], pdf_path, force_ocr, True, report, None, cost, branches[engine],
+            on_running=started.set if engine == primary else None, use_cache=use_cache, output_dir=output_dir
+        )
+    
+    # 败方线程在后台自行退出，不等待
+    pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="hedge")
+    try:
+        futures = {pool.submit(run, primary): primary}
+        next(iter(futures)).add_done_callback(lambda _: started.set())
+        started.wait(min(hedge_after, deadline.remaining()))
+        if not started.is_set():
+            futures[pool.submit(run, backup)] = backup
+        
+        errors = {}
+        for future in as_completed(futures):
+            engine = futures[future]
+            try:
+                result_dir = future.result()
+            except Exception as e:
+                errors[engine] = e
+                continue
+            # 另一方可能还在排队或解析（例如本方直接命中缓存），不再等它
+            for other, branch in branches.items():
+                if other != engine: branch.cancel()
+            return engine, result_dir
+        # 都失败时优先报告非取消的错误（主引擎优先）
+        for engine in (primary, backup):
+            if engine in errors and not isinstance(errors[engine], JobCancelledError): raise errors[engine]
+        raise errors[primary]
+    finally:
+        pool.shutdown(wait=False)
+
+# =========================================================
+# 大文件分块并行解析
+# =========================================================
+# 超过 SPLIT_THRESHOLD_PAGES 页的 PDF 用 pypdf 每 CHUNK_PAGES 页切成一块，各块同时提交（仍受 Key 池和限流约束），
+# 结果按页序拼回一个 Markdown：图片保留原文件名（不同块重名时加块前缀并同步改写引用）；
+# 块开头重复了上一块最后一个标题（跨块的章节标题、页眉）时去掉重复。
+# 切块结果是确定的，每块各自进入解析缓存：中断后重跑只需解析未完成的块。
+SPLIT_THRESHOLD_PAGES = int(os.environ.get("PDF_SPLIT_THRESHOLD", 200))
+CHUNK_PAGES = int(os.environ.get("PDF_CHUNK_PAGES", 100))
+# 单个文件同时解析的块数
+CHUNK_CONCURRENCY = int(os.environ.get("PDF_CHUNK_CONCURRENCY", 4))
+
+HEADING_PATTERN = re.compile(r'^(#{1,6})[ \t]+(.+?)[ \t]*#*[ \t]*$', re.M)
+
+def should_split(pages, threshold=SPLIT_THRESHOLD_PAGES):
+    return bool(PYPDF_AVAILABLE and pages and pages > threshold)
+
+def split_pdf(pdf, chunk_pages=CHUNK_PAGES, out_dir=None, prefix=None):
+    """按页切块写入 out_dir，返回 [(起始页, 结束页, PdfSource)]，页号从 1 开始
+
+    块文件名为 <prefix>.p起-止.pdf，prefix 默认为原文件名。
+    """
+    if not PYPDF_AVAILABLE: raise Exception("未安装 pypdf，无法拆分 PDF")
+    source = as_pdf_source(pdf)
+    prefix = prefix or source.stem
+    out_dir = Path(out_dir or f"./output/{source.stem}.chunks")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    chunks = []
+    with source.open() as f:
+        reader = pypdf.PdfReader(f)
+        total = len(reader.pages)
+        for start in range(0, total, chunk_pages):
+            end = min(start + chunk_pages, total)
+            writer = pypdf.PdfWriter()
+            for i in range(start, end): writer.add_page(reader.pages[i])
+            path = out_dir / f"{prefix}.p{start + 1:04d}-{end:04d}.pdf"
+            with open(path, "wb") as out: writer.write(out)
+            chunks.append((start + 1, end, PdfSource(path.name, path=path)))
+    return chunks
+
+def _rewrite_image_refs(content, mapping):
+    """按 {原相对路径: 新相对路径} 改写图片引用"""
+    if not mapping: return content
+    def replace(match):
+        ref = _local_image_ref(match)
+        if ref not in mapping: return match.group(0)
+        raw = match.group(1) or match.group(2)
+        return match.group(0).replace(raw, mapping[ref])
+    return MD_IMAGE_PATTERN.sub(replace, content)
+
+def import_images(content, source_dir, target_dir, prefix):
+    """把 content 引用的本地图片从 source_dir 复制到 target_dir（保持相对路径），返回改写引用后的 content
+
+    target_dir 中已有同名但内容不同的图片时，新图片文件名加上 prefix。
+    """
+    target_dir = Path(target_dir)
+    mapping = {}
+    for match in MD_IMAGE_PATTERN.finditer(content):
+        ref = _local_image_ref(match)
+        if ref is None or ref in mapping: continue
+        src = Path(source_dir) / ref
+        if not src.is_file(): continue
+        rel = posixpath.normpath(ref)
+        if rel.startswith("../"): rel = posixpath.basename(rel)
+        dest = target_dir / rel
+        if dest.exists() and dest.read_bytes() != src.read_bytes():
+            rel = posixpath.join(posixpath.dirname(rel), f"{prefix}{posixpath.basename(rel)}")
+            dest = target_dir / rel
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(src, dest)
+        mapping[ref] = rel
+    return _rewrite_image_refs(content, {k: v for k, v in mapping.items() if k != v})
+
+def stitch_markdown(part_dirs, target_dir):
+    """把各块的结果目录按顺序拼成 target_dir/output.md（图片一并复制），返回 target_dir"""
+    target_dir = Path(target_dir)
+    if target_dir.exists(): shutil.rmtree(target_dir)
+    target_dir.mkdir(parents=True)
+    texts = []
+    last_heading = None
+    for index, part_dir in enumerate(part_dirs, 1):
+        md_path = FormatConverter.get_md_file_path(Path(part_dir))
+        if not md_path: raise Exception(f"第 {index} 块没有 Markdown 结果")
+        content = import_images(md_path.read_text(encoding="utf-8"), md_path.parent, target_dir, f"c{index:03d}_")
+        
+        headings = HEADING_PATTERN.findall(content)
+        if last_heading:
+            stripped = content.lstrip()
+            first = HEADING_PATTERN.match(stripped)
+            if first and first.group(2).strip() == last_heading: content = stripped[first.end():]
+        if headings: last_heading = headings[-1][1].strip()
+        texts.append(content.strip())
+    (target_dir / "output.md").write_text("\n\n".join(t for t in texts if t) + "\n", encoding="utf-8")
+    return target_dir
+
+def chunked_parse(engine, api_keys, pdf_path, force_ocr=False, deadline=None, chunk_pages=CHUNK_PAGES, use_cache=True, on_progress=None, output_dir=None):
+    """分块并行解析，返回拼接后的结果目录 output_dir（默认 ./output/<文件名>）
+
+    on_progress(已完成块数, 总块数) 在调用线程中调用（可用于刷新进度条）；
+    任一块失败时取消其余块并抛出该异常。
+    各块的临时文件和结果目录都以结果目录名为前缀，同一内容的两个任务互不干扰。
+    """
+    source = as_pdf_source(pdf_path)
+    target_dir = Path(output_dir or f"./output/{source.stem}")
+    if use_cache:
+        cached = restore_cached_parse(engine, source, force_ocr, target_dir)
+        if cached: return cached
+    # 各块共用任务总预算；独立的取消标记让失败时只停掉本文件的其他块
+    deadline = (deadline or Deadline(JOB_TIMEOUT_SECONDS)).fork()
+    chunk_dir = target_dir.with_name(f"{target_dir.name}.chunks")
+    chunks = split_pdf(source, chunk_pages, chunk_dir, prefix=target_dir.name)
+    part_dirs = [None] * len(chunks)
+    pool = ThreadPoolExecutor(max_workers=max(1, min(CHUNK_CONCURRENCY, len(chunks))), thread_name_prefix="chunk")
+    try:
+        futures = {
+            pool.submit(
+                parse_with_key_pool, engine, api_keys, chunk, force_ocr, True, None, None,
+                float(end - start + 1), deadline, use_cache=use_cache
+            ): i
+            for i, (start, end, chunk) in enumerate(chunks)
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            part_dirs[futures[future]] = future.result()
+            if on_progress: on_progress(done, len(chunks))
+        output_dir = stitch_markdown(part_dirs, target_dir)
+    except Exception:
+        deadline.cancel()
+        raise
+    finally:
+        pool.shutdown(wait=False)
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+        for part_dir in part_dirs:
+            if part_dir: shutil.rmtree(part_dir, ignore_errors=True)
+    store_cached_parse(engine, source, force_ocr, output_dir, replace=not use_cache)
+    return output_dir
+
+# =========================================================
+# 按页重新解析并替换
+# =========================================================
+# 少数几页解析出错时，只把这几页重新解析，替换当前 Markdown 中对应的片段：
+# 用 pypdf 读出首页和末页下一页的文字层，在 Markdown 中找到对应位置作为片段起止；
+# 没有文字层（扫描件）或找不到时按页数比例估算，由界面提示人工核对。
+# 锚点取页面开头附近、在全文中只出现一次的一小段文字，避开页眉等重复内容。
+ANCHOR_LENGTH = 24
+
+def _normalize_with_index(text):
+    """只保留字母、数字和汉字（小写），返回 (规整后的文本, 每个字符在原文中的位置)"""
+    chars, index = [], []
+    for i, ch in enumerate(text):
+        if ch.isalnum():
+            chars.append(ch.lower())
+            index.append(i)
+    return "".join(chars), index
+
+def _line_starts(text, index):
+    """规整文本中位于行首的位置：与前一个保留字符之间隔着换行"""
+    return {p for p in range(1, len(index)) if "\n" in text[index[p - 1]:index[p]]}
+
+def _find_anchor(norm_md, page_text, start=0, line_starts=frozenset()):
+    """在 norm_md[start:] 中定位 page_text（已规整）的开头，返回规整文本中的位置；找不到返回 None
+
+    line_starts 为 Markdown 的行首位置（_line_starts），向前补齐时不越过匹配所在行的行首。
+    """
+    for offset in range(0, min(len(page_text), 10 * ANCHOR_LENGTH), ANCHOR_LENGTH // 2):
+        probe = page_text[offset:offset + ANCHOR_LENGTH]
+        if len(probe) < ANCHOR_LENGTH // 2: break
+        pos = norm_md.find(probe, start)
+        if pos < 0 or norm_md.find(probe, pos + 1) >= 0: continue
+        # 向前逐字比对到不一致或到行首为止（页眉等 Markdown 里没有的文字不计入；
+        # 上一行末尾碰巧相同的字符也不算，例如标题 "Title" 与页眉 "Header Line" 同以 e 结尾）
+        back = 0
+        while (back < offset and pos - back > start and pos - back not in line_starts
+               and norm_md[pos - back - 1] == page_text[offset - back - 1]):
+            back += 1
+        return pos - back
+    return None
+
+def locate_page_region(md_content, pdf, first, last):
+    """第 first~last 页在 md_content 中对应的区间，返回 (起, 止, 是否按文字定位)；起止都对齐到行首"""
+    if not PYPDF_AVAILABLE: raise Exception("未安装 pypdf，无法定位页码")
+    with as_pdf_source(pdf).open() as f:
+        reader = pypdf.PdfReader(f)
+        total = len(reader.pages)
+        if not 1 <= first <= last <= total: raise ValueError(f"页码范围无效: {first}-{last}（共 {total} 页）")
+        start_text = _normalize_with_index(reader.pages[first - 1].extract_text() or "")[0]
+        end_text = _normalize_with_index(reader.pages[last].extract_text() or "")[0] if last < total else None
+    
+    norm, index = _normalize_with_index(md_content)
+    line_starts = _line_starts(md_content, index)
+    start = _find_anchor(norm, start_text, 0, line_starts) if start_text else None
+    end = _find_anchor(norm, end_text, start or 0, line_starts) if end_text else None
+    exact = start is not None and (end is not None or last == total)
+    
+    start = index[start] if start is not None and start < len(index) else int(len(md_content) * (first - 1) / total)
+    if last == total: end = len(md_content)
+    elif end is not None and end < len(index): end = index[end]
+    else: end = int(len(md_content) * last / total)
+    start = md_content.rfind("\n", 0, start) + 1
+    if end < len(md_content): end = md_content.rfind("\n", 0, end) + 1
+    return start, max(start, end), exact
+
+def reparse_pages(engine, api_keys, pdf, first, last, force_ocr=False, silent=False, use_cache=True):
+    """只解析第 first~last 页，返回结果目录（./output/<文件名>.p起-止，不影响整本的结果目录）"""
+    trimmed = trim_pdf(pdf, f"{first}-{last}")
+    source = PdfSource(f"{trimmed.stem}.p{first:04d}-{last:04d}.pdf", path=trimmed.path, buffer=trimmed.buffer)
+    return parse_with_key_pool(engine, api_keys, source, force_ocr, silent, use_cache=use_cache)
+
+def splice_markdown(md_content, start, end, part_dir, image_dir):
+    """用 part_dir 中的解析结果替换 md_content[start:end]，返回新全文
+
+    新图片复制到 image_dir（当前 Markdown 所在目录），重名时加前缀；
+    只被旧片段引用的图片随之删除。
+    """
+    md_path = FormatConverter.get_md_file_path(Path(part_dir))
+    if not md_path: raise Exception("重新解析的结果中没有 Markdown 文件")
+    image_dir = Path(image_dir)
+    new_part = import_images(md_path.read_text(encoding="utf-8"), md_path.parent, image_dir, f"r{uuid.uuid4().hex[:6]}_")
+    new_part = new_part.strip() + "\n\n"
+    content = md_content[:start] + new_part + md_content[end:]
+    
+    kept = {_local_image_ref(m) for m in MD_IMAGE_PATTERN.finditer(content)}
+    for match in MD_IMAGE_PATTERN.finditer(md_content[start:end]):
+        ref = _local_image_ref(match)
+        if ref is None or ref in kept: continue
+        path = (image_dir / ref).resolve()
+        if path.is_file() and path.is_relative_to(image_dir.resolve()): path.unlink()
+    return content
+
+# 批量任务选项：键与任务日志的 options 字段相同，缺省的键按这里的默认值处理
+JOB_OPTION_DEFAULTS = {
+    "force_ocr": False, "math_mode": "mathml", "hedge": False, "use_cache": True,
+    "split": False, "page_range": None, "slim": False, "local_mode": LOCAL_OFF,
+}
+
+def job_options(options=None, **overrides):
+    """补全默认值后的任务选项（未知的键原样保留）"""
+    return {**JOB_OPTION_DEFAULTS, **(options or {}), **overrides}
+
+def job_output_dir(pdf, job_id):
+    """批量任务的结果目录 ./output/<文件名>-<任务 ID 摘要>
+
+    落盘文件按内容命名，同一内容的两个任务（不同会话、本机与 worker）若共用 ./output/<sha256>，
+    下载或取缓存时会清空对方正在转换的目录，因此按任务区分。
+    """
+    digest = hashlib.sha256(str(job_id).encode("utf-8")).hexdigest()[:12]
+    return Path("./output") / f"{as_pdf_source(pdf).stem}-{digest}"
+
+def process_single_file_task(file_info, api_key_doc2x, api_key_mineru, temp_dir, journal=None, options=None):
+    """单个文件的处理任务函数，运行在独立线程中
+
+    journal 为 JobStore 时，每完成一个阶段都写入任务日志；
+    日志里已有记录的任务会从最后完成的阶段继续，不重复上传和解析。
+    options 为任务选项（缺省的键见 JOB_OPTION_DEFAULTS，通常直接传任务日志里的 options）：
+    hedge 为 True 且两个引擎都有 Key 时，尚未提交的任务走对冲解析 (hedged_parse)。
+    use_cache 为 False 时绕过解析缓存，强制重新解析。
+    split 为 True 时，超过 SPLIT_THRESHOLD_PAGES 页的新任务分块并行解析 (chunked_parse)。
+    page_range（如 "1-20, 35"）不为空时只解析这些页。
+    slim 为 True 时上传前无损瘦身 (slim_pdf)，节省的字节数记入 result["saved_bytes"] 和任务日志。
+    force_ocr 为 None 时按文字层抽样自动决定；实际使用的值记入 result["force_ocr"]（引擎不是 MinerU 时为 None）。
+    local_mode 决定是否用本地提取 (LocalTextClient) 代替云端引擎，见 select_engine。
+    """
+    options = job_options(options)
+    force_ocr, math_mode, hedge, use_cache = options["force_ocr"], options["math_mode"], options["hedge"], options["use_cache"]
+    split, page_range, slim, local_mode = options["split"], options["page_range"], options["slim"], options["local_mode"]
+    result = {"success": False, "error": None, "result_path": None, "saved_bytes": 0, "force_ocr": None}
+    file_id = file_info['id']
+    resume = (journal.get_job(file_id) if journal else None) or {}
+    
+    engine = None
+    # 整个任务的总预算：卡住的任务到点失败并释放槽位
+    deadline = Deadline(JOB_TIMEOUT_SECONDS)
+    
+    def on_stage(stage, **fields):
+        # 同时记下实际使用的引擎：远端 ID 只在该引擎有效
+        if journal: journal.record_stage(file_id, stage, **{"engine": engine, **fields})
+    
+    try:
+        if journal: journal.set_status(file_id, JOB_RUNNING)
+        
+        # 1. 准备文件路径
+        pdf_path = Path(resume["pdf_path"]) if resume.get("pdf_path") else temp_dir / file_info['name']
+        if page_range: pdf_path = trim_pdf(pdf_path, page_range)
+        # 获取原始文件名（不含后缀），例如 "我的文档"
+        original_stem = Path(file_info['name']).stem
+        
+        # 2. 选择引擎（已提交的续跑任务必须沿用原引擎，远端 ID 只在该引擎有效）；
+        #    自动本地提取和自动 OCR 共用一次文字层抽样，只有需要时才抽样
+        submitted = stage_reached(resume.get("stage"), STAGE_PARSE_SUBMITTED)
+        engine = resume.get("engine") if submitted else None
+        probe = None
+        if engine is None:
+            if local_mode == LOCAL_AUTO: probe = DocumentStats.probe_text_layer(pdf_path)
+            engine = select_engine(api_key_doc2x, api_key_mineru, pdf_path, local_mode, probe)
+        # OCR 开关只对 MinerU 有意义（对冲解析同样以 MinerU 为主引擎），其他引擎不抽样
+        if engine == "mineru": force_ocr = result["force_ocr"] = resolve_force_ocr(force_ocr, pdf_path, probe)
+        if slim and not submitted and engine != "local":
+            pdf_path, result["saved_bytes"] = slim_pdf(pdf_path)
+            if journal and result["saved_bytes"]: journal.record_saved_bytes(file_id, result["saved_bytes"])
+        cost = resume.get("cost") or DocumentStats.estimate_parse_cost(pdf_path)
+        output_dir = None
+        if stage_reached(resume.get("stage"), STAGE_DOWNLOADED) and resume.get("result_path"):
+            if Path(resume["result_path"]).exists():
+                output_dir = Path(resume["result_path"])
+        
+        if output_dir is None:
+            chunked = split and not submitted and should_split(DocumentStats.count_pdf_pages(pdf_path))
+            target_dir = job_output_dir(pdf_path, file_id)
+            
+            def parse(api_keys):
+                if chunked: return chunked_parse(engine, api_keys, pdf_path, force_ocr, deadline, use_cache=use_cache, output_dir=target_dir)
+                return parse_with_key_pool(engine, api_keys, pdf_path, force_ocr, True, on_stage, resume, cost, deadline, use_cache=use_cache, output_dir=target_dir)
+            
+            if engine == "local":
+                output_dir = LocalTextClient(deadline, target_dir).process(pdf_path, silent=True, on_stage=on_stage)
+            elif hedge and api_key_doc2x and api_key_mineru and not submitted and not chunked:
+                engine, output_dir = hedged_parse(api_key_doc2x, api_key_mineru, pdf_path, force_ocr, on_stage, cost, deadline, use_cache=use_cache, output_dir=target_dir)
+            elif engine == "mineru":
+                if not api_key_mineru: raise Exception("未配置 API Key (期刊增强)")
+                output_dir = parse(api_key_mineru)
+            elif engine == "doc2x":
+                if not api_key_doc2x: raise Exception("未配置 API Key (标准引擎)")
+                output_dir = parse(api_key_doc2x)
+            else:
+                raise Exception("未配置 API Key")
+            # 记录绝对路径，界面和其他 worker 进程都能找到结果
+            output_dir = Path(output_dir).resolve()
+            on_stage(STAGE_DOWNLOADED, result_path=str(output_dir))
+
+        # 3. 查找并重命名 Markdown 文件
+        md_path = FormatConverter.get_md_file_path(output_dir)
+        if not md_path:
+            raise Exception("未找到 Markdown 文件")
+            
+        # ⭐ 核心修改：将提取出的 Markdown 重命名为原文件名
+        # 使用 with_name 保持在同一目录，确保图片相对路径不中断
+        new_md_path = md_path.with_name(f"{original_stem}.md")
+        
+        # 如果文件名不同，则重命名
+        if md_path != new_md_path:
+            # 如果目标文件已存在（极少情况），先删除
+            if new_md_path.exists():
+                new_md_path.unlink()
+            md_path.rename(new_md_path)
+            md_path = new_md_path # 更新变量指向新路径
+
+        # 4. 设置输出路径 (使用原文件名)
+        # 将生成的 Word 和 Epub 放在 output_dir 根目录下，方便查找
+        docx_path = output_dir / f"{original_stem}.docx"
+        epub_path = output_dir / f"{original_stem}.epub"
+        
+        # 5. 格式转换
+        # 转换 Word
+        FormatConverter.run_pandoc(md_path, docx_path, "docx")
+        
+        # 转换 Epub (带 CSS 修复)
+        FormatConverter.run_pandoc(
+            md_path, epub_path, "epub",
+            source_filename=file_info['name'], # 传递原文件名用于元数据
+            math_mode=math_mode
+        )
+        
+        on_stage(STAGE_CONVERTED)
+        result["success"] = True
+        result["result_path"] = str(output_dir)
+        
+    except Exception as e:
+        result["error"] = str(e)
+    
+    if journal:
+        if result["success"]:
+            journal.set_status(file_id, JOB_DONE, result_path=result["result_path"])
+        else:
+            journal.set_status(file_id, JOB_FAILED, error_msg=result["error"])
+        
+    return file_id, result
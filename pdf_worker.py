@@ -0,0 +1,121 @@
+"""
+独立解析 worker：从共享 SQLite 队列领取任务，执行解析与格式转换，把结果写回任务日志。
+
+用法:
+    python pdf_worker.py --db ./batch_jobs.db --concurrency 3
+
+API Key 通过 --doc2x-key / --mineru-key 或环境变量 DOC2X_API_KEY / MINERU_API_KEY 提供。
+多台机器运行 worker 时，需要挂载同一个共享目录，并让数据库、temp_uploads
+和 output 位于相同的绝对路径下（任务记录里保存的是绝对路径）。
+
+设置 PDF_CALLBACK_URL / PDF_CALLBACK_BIND 后，worker 会启动回调接收器，MinerU 任务完成时
+由服务商通知唤醒，轮询只作兜底（见 callback_receiver.py）。同一台机器上的多个进程需使用不同端口。
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from batch_runner import POLICY_FIFO, POLICY_SJF
+from job_store import JobStore, WORKER_LEASE_SECONDS
+from pdf_pipeline import process_single_file_task
+
+logger = logging.getLogger("pdf_worker")
+
+
+class PipelineWorker:
+    def __init__(self, store, api_key_doc2x=None, api_key_mineru=None, concurrency=3, poll_interval=2.0, policy=POLICY_FIFO):
+        self.store = store
+        self.api_key_doc2x = api_key_doc2x
+        self.api_key_mineru = api_key_mineru
+        self.concurrency = max(1, int(concurrency))
+        self.poll_interval = poll_interval
+        self.policy = policy
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._running = set()
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self):
+        """主循环：有空闲槽位就领取任务，直到收到停止信号且手上任务全部结束"""
+        self.store.register_worker(self.worker_id, socket.gethostname(), os.getpid(), self.concurrency)
+        heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        heartbeat.start()
+        logger.info("worker %s 启动，并发数 %d，数据库 %s", self.worker_id, self.concurrency, self.store.db_path)
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="pdf-worker") as executor:
+                while not self._stop.is_set():
+                    with self._lock:
+                        free = self.concurrency - len(self._running)
+                    job = self.store.claim_next_job(self.worker_id, policy=self.policy) if free > 0 else None
+                    if job is None:
+                        self._stop.wait(self.poll_interval)
+                        continue
+                    with self._lock:
+                        self._running.add(job["id"])
+                    executor.submit(self._execute, job)
+        finally:
+            self.store.unregister_worker(self.worker_id)
+            logger.info("worker %s 已退出", self.worker_id)
+
+    def _execute(self, job):
+        job_info = {k: job[k] for k in ("id", "name", "size", "upload_time")}
+        options = job["options"]
+        logger.info("开始处理 %s (阶段: %s)", job["name"], job["stage"])
+        try:
+            _, res = process_single_file_task(
+                job_info, self.api_key_doc2x, self.api_key_mineru, Path(job["pdf_path"]).parent, self.store, options
+            )
+            if options.get("force_ocr") is None and res["force_ocr"] is not None: logger.info("%s 自动判断 OCR: %s", job["name"], "启用" if res["force_ocr"] else "不启用")
+            if res["saved_bytes"]: logger.info("%s 上传前瘦身节省 %.1f KB", job["name"], res["saved_bytes"] / 1024)
+            if res["success"]: logger.info("完成 %s -> %s", job["name"], res["result_path"])
+            else: logger.warning("失败 %s: %s", job["name"], res["error"])
+        finally:
+            with self._lock:
+                self._running.discard(job["id"])
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(WORKER_LEASE_SECONDS / 4):
+            with self._lock:
+                job_ids = list(self._running)
+            try:
+                self.store.heartbeat(self.worker_id, job_ids)
+            except Exception as e:
+                logger.warning("心跳写入失败: %s", e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF 解析队列 worker")
+    parser.add_argument("--db", default="./batch_jobs.db", help="共享任务数据库路径")
+    parser.add_argument("--concurrency", type=int, default=3, help="同时处理的任务数")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="队列为空时的轮询间隔（秒）")
+    parser.add_argument("--policy", choices=[POLICY_FIFO, POLICY_SJF], default=POLICY_FIFO,
+                        help="领取顺序：fifo 按入队顺序，sjf 短作业优先（带 aging）")
+    parser.add_argument("--doc2x-key", default=os.environ.get("DOC2X_API_KEY"), help="标准引擎 API Key")
+    parser.add_argument("--mineru-key", default=os.environ.get("MINERU_API_KEY"), help="期刊增强 API Key")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if not args.doc2x_key and not args.mineru_key:
+        parser.error("至少需要提供一个 API Key")
+
+    worker = PipelineWorker(
+        JobStore(args.db), args.doc2x_key, args.mineru_key,
+        concurrency=args.concurrency, poll_interval=args.poll_interval, policy=args.policy
+    )
+    # 收到信号后不再领取新任务，等手上的任务做完再退出
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()
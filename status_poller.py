@@ -0,0 +1,173 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from api_guard import CircuitOpenError
+
+# =========================================================
+# 统一状态轮询器 (asyncio)
+# =========================================================
+# 所有进行中任务的状态查询（Doc2X 解析 / 导出、MinerU 结果）都登记到同一个事件循环：
+#   - 每个任务的轮询是循环里的一个协程，查询间隔由事件循环计时；
+#   - 到期的查询并发发出，真正执行 HTTP 请求的线程数固定为 max_concurrency；
+#   - 每个任务拿到一个 Future，完成时写入结果，失败或超时写入异常。
+# 注意：收拢的只是查询请求本身。任务线程（批量槽位 / worker 线程）仍在 wait_for 里阻塞等待 Future，
+# 所以同时进行的任务数仍受这些线程数限制；省下的是各自 sleep + 发请求的循环和 HTTP 并发。
+# 轮询器是模块级单例，由后台线程持有事件循环，界面、后台批量和 worker 进程内共用。
+
+# 同时执行的状态查询请求数
+POLL_CONCURRENCY = int(os.environ.get("PDF_POLL_CONCURRENCY", 16))
+
+# 自适应轮询间隔的上下限（秒）
+POLL_MIN_SECONDS = float(os.environ.get("PDF_POLL_MIN", 0.5))
+POLL_MAX_SECONDS = float(os.environ.get("PDF_POLL_MAX", 30))
+# 没有进度信息时，每页预估的起步间隔（600 页的书约 30 秒查一次，2 页的笔记按下限）
+POLL_SECONDS_PER_PAGE = 0.05
+
+
+class AdaptiveInterval:
+    """根据进度变化速度安排下一次轮询
+
+    第一次查询按下限尽快发出；之后如果有进度（observe 传入 0~1 的完成比例），
+    按进度速率估算剩余时间，取其 1/4 作为间隔，越接近完成查得越勤；
+    没有进度信息或进度停滞时，从按页数估算的起步间隔开始按 backoff 倍数拉长。
+    所有间隔都夹在 [minimum, maximum] 之间。
+    """
+
+    def __init__(self, initial=1.0, pages=None, minimum=POLL_MIN_SECONDS, maximum=POLL_MAX_SECONDS, backoff=1.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        if pages: initial = max(initial, pages * POLL_SECONDS_PER_PAGE)
+        self._idle = self._clamp(initial)
+        self._first = None   # (时间, 进度) 第一次观测
+        self._last = None    # (时间, 进度) 最近一次观测
+        self._polls = 0
+
+    def expect_pages(self, pages):
+        """页数估算变大时（如同一 batch 后加入了更大的文件）相应放宽没有进度信息时的间隔"""
+        if pages: self._idle = max(self._idle, self._clamp(pages * POLL_SECONDS_PER_PAGE))
+
+    def _clamp(self, seconds):
+        return min(self.maximum, max(self.minimum, seconds))
+
+    def observe(self, fraction):
+        """记录一次查询得到的完成比例（0~1）"""
+        if fraction is None: return
+        now = time.monotonic()
+        fraction = min(1.0, max(0.0, float(fraction)))
+        if self._first is None: self._first = (now, fraction)
+        self._last = (now, fraction)
+
+    def next_delay(self):
+        self._polls += 1
+        if self._polls == 1: return self.minimum
+        if self._first and self._last and self._last[0] > self._first[0]:
+            rate = (self._last[1] - self._first[1]) / (self._last[0] - self._first[0])
+            if rate > 0:
+                return self._clamp((1.0 - self._last[1]) / rate / 4)
+        delay = self._idle
+        self._idle = self._clamp(self._idle * self.backoff)
+        return delay
+
+
+class StatusPoller:
+    def __init__(self, max_concurrency=POLL_CONCURRENCY):
+        self._loop = asyncio.new_event_loop()
+        self._io = ThreadPoolExecutor(max_workers=max(1, int(max_concurrency)), thread_name_prefix="status-poll")
+        self._lock = threading.Lock()
+        self._watching = 0
+        self._wakers = {}  # key -> {asyncio.Event}，只在事件循环线程中访问
+        self._thread = threading.Thread(target=self._loop.run_forever, name="status-poller", daemon=True)
+        self._thread.start()
+
+    def watch(self, poll, interval, deadline=None, key=None):
+        """登记一个待轮询任务，返回 concurrent.futures.Future
+
+        poll() 查询一次状态：完成时返回 (True, 结果)，未完成返回 (False, None)，失败直接抛异常
+        （CircuitOpenError 除外：按未完成处理，下一轮再查）。
+        interval 为固定秒数，或每次调用返回下一次等待秒数的函数（如 AdaptiveInterval.next_delay）；
+        deadline 超时或被取消时 Future 以对应异常结束（取消时立即结束，不等下一次查询）。
+        key 用于 wake()：例如回调通知到达时提前查询。
+        """
+        future = Future()
+        asyncio.run_coroutine_threadsafe(self._track(poll, interval, deadline, future, key), self._loop)
+        return future
+
+    def wake(self, key):
+        """让登记在 key 下的任务立即查询一次（可在任意线程调用）"""
+        self._loop.call_soon_threadsafe(self._wake, key)
+
+    def _wake(self, key):
+        for event in self._wakers.get(key, ()):
+            event.set()
+
+    async def _track(self, poll, interval, deadline, future, key=None):
+        with self._lock:
+            self._watching += 1
+        wake = asyncio.Event()
+        if key is not None: self._wakers.setdefault(key, set()).add(wake)
+        # 任务被取消时立即醒来结束轮询，不必等到下一次查询时间
+        on_cancel = lambda: self._loop.call_soon_threadsafe(wake.set)
+        if deadline: deadline.add_cancel_callback(on_cancel)
+        try:
+            while not future.cancelled():
+                wait = interval() if callable(interval) else interval
+                if deadline: wait = min(wait, deadline.remaining())
+                try:
+                    await asyncio.wait_for(wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                wake.clear()
+                if deadline: deadline.check()
+                try:
+                    done, value = await self._loop.run_in_executor(self._io, poll)
+                except CircuitOpenError:
+                    # 引擎熔断中：任务已在服务端排队，跳过这一轮，等熔断恢复后接着查
+                    continue
+                if done:
+                    future.set_result(value)
+                    return
+        except Exception as e:
+            if not future.cancelled(): future.set_exception(e)
+        finally:
+            if deadline: deadline.remove_cancel_callback(on_cancel)
+            if key is not None:
+                self._wakers[key].discard(wake)
+                if not self._wakers[key]: del self._wakers[key]
+            with self._lock:
+                self._watching -= 1
+
+    @property
+    def watching(self):
+        """当前登记中的任务数"""
+        return self._watching
+
+
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def get_status_poller():
+    """进程级共享的轮询器"""
+    global _poller
+    with _poller_lock:
+        if _poller is None:
+            _poller = StatusPoller()
+        return _poller
+
+
+def wait_for(future, on_wait=None, tick=0.5, deadline=None):
+    """阻塞调用线程直到 Future 完成；on_wait 不为空时每 tick 秒调用一次（在调用线程中刷新进度条等界面）
+
+    deadline 不为空时，等待方自己超时或被取消也会结束等待（Future 由多个任务共用时使用）。
+    """
+    if on_wait is None and deadline is None: return future.result()
+    while True:
+        try:
+            return future.result(timeout=tick)
+        except FutureTimeoutError:
+            if deadline: deadline.check()
+            if on_wait: on_wait()